@@ -0,0 +1,205 @@
+"""
+ASGI adapter for housechores, python 3 only
+
+The flask app runs on a bounded pool of ASGI_WORKERS threads, the event loop
+only keeps the connections. A request holds a thread while the app answers
+it (sqlite and the app are synchronous), not while it waits: the long poll
+on /changes is repeated with ?timeout=0 on the loop, every
+CHANGES_POLL_SECONDS, so a waiting client costs no thread.
+
+See housechores_asgi.py for the entry point.
+"""
+import sys
+import json
+import time
+import asyncio
+import tempfile
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+
+#the request bodies are kept in memory up to this size, then in a file
+BODY_MEMORY_SIZE=1024*1024
+
+class WsgiToAsgi(object):
+    """Serve a WSGI app as an ASGI app
+    """
+    def __init__(self, wsgi_app, workers=None):
+        self.wsgi_app=wsgi_app
+        self.config=wsgi_app.config
+        self.workers=workers or self.config['ASGI_WORKERS']
+        self.executor=ThreadPoolExecutor(max_workers=self.workers)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type']=='lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type']=='http':
+            body=await read_body(receive)
+            environ=make_environ(scope, body)
+            if environ['PATH_INFO']=='/changes' and environ['REQUEST_METHOD']=='GET':
+                await self.long_poll(environ, send)
+            else:
+                loop=asyncio.get_event_loop()
+                await loop.run_in_executor(self.executor, self.run_wsgi, environ,
+                    lambda message: asyncio.run_coroutine_threadsafe(send(message), loop).result())
+        else:
+            raise ValueError('unsupported ASGI scope type: %s' %(scope['type']))
+
+    async def lifespan(self, receive, send):
+        """Answer the startup and shutdown of the server
+        """
+        while True:
+            message=await receive()
+            if message['type']=='lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type']=='lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def run_wsgi(self, environ, send):
+        """Run the WSGI app for one request, in a thread of the pool
+
+        The answer is given to send as ASGI messages. A streamed answer is
+        read in this same thread, as it may use the sqlite connection of the
+        thread; send waits until the client took each part.
+        """
+        response={}
+        def start_response(status, headers, exc_info=None):
+            if exc_info and 'started' in response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status']=int(status.split(' ', 1)[0])
+            response['headers']=[(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        def start():
+            if 'started' not in response:
+                response['started']=True
+                send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+        result=self.wsgi_app(environ, start_response)
+        try:
+            for data in result:
+                if data:
+                    start()
+                    send({'type': 'http.response.body', 'body': data, 'more_body': True})
+            start()
+            send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        environ['wsgi.input'].close()
+
+    async def long_poll(self, environ, send):
+        """Answer /changes: ask the app with ?timeout=0 until there is a
+        change or the timeout is over
+        """
+        args=dict(parse_qsl(environ['QUERY_STRING']))
+        try:
+            timeout=min(float(args.get('timeout', self.config['CHANGES_TIMEOUT'])), self.config['CHANGES_TIMEOUT'])
+        except ValueError:
+            timeout=self.config['CHANGES_TIMEOUT']
+        args['timeout']='0'
+        environ['QUERY_STRING']=urlencode(args)
+        body=environ['wsgi.input'].read()
+        environ['wsgi.input'].close()
+        deadline=time.time()+timeout
+        loop=asyncio.get_event_loop()
+        while True:
+            messages=[]
+            await loop.run_in_executor(self.executor, self.run_wsgi, dict(environ, **{'wsgi.input': BytesIO(body)}), messages.append)
+            if messages[0]['status']!=200 or time.time()>=deadline or changed(messages):
+                break
+            await asyncio.sleep(self.config['CHANGES_POLL_SECONDS'])
+        for message in messages:
+            await send(message)
+
+def changed(messages):
+    """Tell if the (json) answer of /changes says there was a change
+    """
+    try:
+        return json.loads(b''.join(message.get('body', b'') for message in messages).decode('utf-8'))['changed']
+    except (ValueError, KeyError):
+        return True
+
+async def read_body(receive):
+    """Read the body of a request, in memory or (when large) in a file
+    """
+    body=tempfile.SpooledTemporaryFile(BODY_MEMORY_SIZE)
+    more_body=True
+    while more_body:
+        message=await receive()
+        if message['type']=='http.disconnect':
+            break
+        body.write(message.get('body', b''))
+        more_body=message.get('more_body', False)
+    body.seek(0)
+    return body
+
+def make_environ(scope, body):
+    """Make the WSGI environ of an ASGI http scope
+    """
+    path=scope['path']
+    root_path=scope.get('root_path', '')
+    if root_path and path.startswith(root_path):
+        path=path[len(root_path):]
+    server=scope.get('server') or ('localhost', 80)
+    environ={
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' %(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name=name.decode('latin-1').upper().replace('-', '_')
+        value=value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name='HTTP_' + name
+        environ[name]=environ[name] + ',' + value if name in environ else value
+    #the body is read already, so its length is known (also when chunked)
+    body.seek(0, 2)
+    if body.tell():
+        environ['CONTENT_LENGTH']=str(body.tell())
+    body.seek(0)
+    return environ
+
+async def asgi_request(application, method, path, query_string='', headers=None, body=b''):
+    """Send one request to an ASGI app, for the tests and the load test
+
+    Returns the status, the headers (a dict) and the body.
+    """
+    scope={
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'root_path': '',
+        'query_string': query_string.encode('latin-1'),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in (headers or {}).items()],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 5000),
+    }
+    messages=[{'type': 'http.request', 'body': body, 'more_body': False}]
+    async def receive():
+        if messages:
+            return messages.pop()
+        #nothing more to read: wait for a disconnect that does not come
+        await asyncio.Future()
+    response={'body': []}
+    async def send(message):
+        if message['type']=='http.response.start':
+            response['status']=message['status']
+            response['headers']=dict((name.decode('latin-1'), value.decode('latin-1')) for name, value in message['headers'])
+        else:
+            response['body'].append(message.get('body', b''))
+    await application(scope, receive, send)
+    return response['status'], response['headers'], b''.join(response['body'])
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Load test of the ASGI entry point against the WSGI one, python 3 only
+
+Many clients at once: api clients that request a page again and again, and
+long poll clients that wait on /changes. Under WSGI (like mod_wsgi) every
+request holds one of --threads threads, also while it waits; under ASGI the
+same number of threads only run the app. The apps are called in this
+process, so the numbers leave out the network and the server.
+
+Run from the app directory:
+>>>> python3 bench_asgi.py --clients 50 --pollers 0 20 100
+"""
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import housechores
+import asgi
+from bench_housechores import setup_database, teardown_database, percentile
+
+def login_cookie():
+    """Log in as admin and get the session cookie
+    """
+    rv=housechores.app.test_client().post('/login', data=dict(user='admin', password='admin'))
+    return rv.headers['Set-Cookie'].split(';')[0]
+
+def summary(times, seconds):
+    """Get the requests/second, p50 and p99 (ms) of the api requests
+    """
+    times.sort()
+    if not times:
+        return 0.0, float('nan'), float('nan')
+    return len(times)/seconds, percentile(times, 0.5), percentile(times, 0.99)
+
+def run_wsgi(args, cookie, pollers):
+    """The clients on the WSGI app, every request holds a thread of the pool
+    """
+    pool=ThreadPoolExecutor(max_workers=args.threads)
+    rv=housechores.app.test_client().get('/changes?since=none', headers={'Cookie': cookie})
+    since=json.loads(rv.data.decode('utf-8'))['change_counter']
+    times=[]
+    end=time.time()+args.seconds
+    def request(url):
+        client=housechores.app.test_client()
+        rv=client.get(url, headers={'Cookie': cookie})
+        rv.get_data()
+        assert rv.status_code==200, url
+    def api_client():
+        while time.time()<end:
+            start=time.time()
+            pool.submit(request, args.url).result()
+            if time.time()<end:
+                times.append((time.time()-start)*1000)
+    def poll_client():
+        while time.time()<end:
+            pool.submit(request, '/changes?since=%s&timeout=%s' %(since, args.poll_timeout)).result()
+    clients=[threading.Thread(target=api_client) for i in range(args.clients)]
+    clients+=[threading.Thread(target=poll_client) for i in range(pollers)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    pool.shutdown()
+    return summary(times, args.seconds)
+
+def run_asgi(args, cookie, pollers):
+    """The clients on the ASGI app, as tasks on one event loop
+    """
+    application=asgi.WsgiToAsgi(housechores.app, workers=args.threads)
+    headers={'Cookie': cookie}
+    times=[]
+    async def clients():
+        status, response_headers, body=await asgi.asgi_request(application, 'GET', '/changes', 'since=none', headers)
+        since=json.loads(body.decode('utf-8'))['change_counter']
+        end=time.time()+args.seconds
+        path, _, query_string=args.url.partition('?')
+        async def api_client():
+            while time.time()<end:
+                start=time.time()
+                status, response_headers, body=await asgi.asgi_request(application, 'GET', path, query_string, headers)
+                assert status==200, args.url
+                if time.time()<end:
+                    times.append((time.time()-start)*1000)
+        async def poll_client():
+            while time.time()<end:
+                await asgi.asgi_request(application, 'GET', '/changes', 'since=%s&timeout=%s' %(since, args.poll_timeout), headers)
+        await asyncio.gather(*([api_client() for i in range(args.clients)] + [poll_client() for i in range(pollers)]))
+    loop=asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(clients())
+    finally:
+        loop.close()
+        application.executor.shutdown()
+    return summary(times, args.seconds)
+
+def main(argv):
+    """Run the load test for every number of long poll clients
+    """
+    parser=argparse.ArgumentParser(description='Load test of the ASGI entry point against the WSGI one.')
+    parser.add_argument('--actions', type=int, default=10000, help='number of actions in the database')
+    parser.add_argument('--clients', type=int, default=50, help='api clients')
+    parser.add_argument('--pollers', type=int, nargs='+', default=[0, 20, 100], help='long poll clients')
+    parser.add_argument('--threads', type=int, default=15, help='threads that run the app (mod_wsgi threads, ASGI_WORKERS)')
+    parser.add_argument('--seconds', type=float, default=10, help='seconds per measurement')
+    parser.add_argument('--poll-timeout', type=float, default=5, help='timeout of a long poll (seconds)')
+    parser.add_argument('--url', default='/overview?format=json', help='page of the api clients')
+    args=parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    db_fd, path=setup_database(args.actions)
+    try:
+        cookie=login_cookie()
+        print('%-5s %8s %8s %12s %10s %10s' %('path', 'clients', 'pollers', 'requests/s', 'p50 (ms)', 'p99 (ms)'))
+        for pollers in args.pollers:
+            for name, run in (('wsgi', run_wsgi), ('asgi', run_asgi)):
+                print('%-5s %8s %8s %12.1f %10.2f %10.2f' %((name, args.clients, pollers) + run(args, cookie, pollers)))
+    finally:
+        teardown_database(db_fd, path)
+
+if __name__=='__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+"""
+Benchmarks for housechores
+
+Run from the app directory:
+>>>> python bench_housechores.py connections
+>>>> python bench_housechores.py stats
+>>>> python bench_housechores.py routes --scale 0.01 0.1 1
+>>>> python bench_housechores.py writes --threads 1 8 32
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import logging
+import argparse
+import tempfile
+import threading
+import platform
+import subprocess
+from datetime import date, datetime, timedelta
+
+import housechores
+
+DEFAULT_CONFIG=dict((key, housechores.app.config[key]) for key in housechores.app.config if key=='PERSISTENT_CONNECTIONS' or key.startswith('SQLITE_'))
+
+def setup_database(actions=10000, days=2000, chores=9, persons=4):
+    """Create a new database with generated chores, persons and actions
+
+    The actions are spread over days, starting at 2010-01-01, see
+    housechores.generate_actions.
+    Returns the file descriptor and the path of the database.
+    """
+    db_fd, housechores.app.config['DATABASE']=tempfile.mkstemp()
+    housechores.app.config['TESTING']=True
+    housechores.app.config['SERVER_NAME']='localhost:5000'
+    housechores.app.config['SECRET_KEY']='testingkey'
+    housechores.app.config['DEBUG']=False
+    housechores.app.debug=False
+    #with DEBUG in config.py the debug toolbar was set up on import, and
+    #app.debug=False does not undo that: show it to nobody
+    housechores.app.config['DEBUG_TB_HOSTS']=('nobody',)
+    with housechores.app.app_context():
+        housechores.init_the_db()
+        housechores.generate_actions(housechores.get_db(), actions, chores, persons, days,
+            end=date(2010, 1, 1)+timedelta(days=days-1), seed=random.random(), offline=True)
+    return db_fd, housechores.app.config['DATABASE']
+
+def teardown_database(db_fd, path):
+    """Close and remove the benchmark database
+    """
+    housechores.close_thread_db()
+    housechores.invalidate_settings()
+    os.close(db_fd)
+    for filename in (path, path + '-wal', path + '-shm'):
+        if os.path.exists(filename):
+            os.unlink(filename)
+
+def login(client, user='admin', password='admin'):
+    """perform a basic login
+    """
+    return client.post('/login', data=dict(user=user, password=password))
+
+def requests_per_second(client, urls, seconds):
+    """Request the urls in turn for some seconds and return requests/second
+    """
+    count=0
+    start=time.time()
+    while time.time()-start<seconds:
+        for url in urls:
+            rv=client.get(url)
+            assert rv.status_code==200, url
+        count+=len(urls)
+    return count/(time.time()-start)
+
+def bench_connections(args):
+    """Compare the throughput with and without persistent, tuned connections
+    """
+    no_pragmas=dict(('SQLITE_' + pragma.upper(), None) for pragma in housechores.SQLITE_PRAGMAS)
+    setups=[
+        ('connection per request, no pragmas', dict(no_pragmas, PERSISTENT_CONNECTIONS=False)),
+        ('connection per request, pragmas', dict(DEFAULT_CONFIG, PERSISTENT_CONNECTIONS=False)),
+        ('persistent connection, pragmas', dict(DEFAULT_CONFIG, PERSISTENT_CONNECTIONS=True)),
+    ]
+    urls=['/', '/overview', '/chores_lastaction', '/stats']
+    for name, config in setups:
+        housechores.app.config.update(config)
+        db_fd, path=setup_database(args.actions)
+        try:
+            client=housechores.app.test_client()
+            login(client)
+            print('%-40s %8.1f requests/second' %(name, requests_per_second(client, urls, args.seconds)))
+        finally:
+            teardown_database(db_fd, path)
+    housechores.app.config.update(DEFAULT_CONFIG)
+
+def median_time(client, url, repeat):
+    """Request url repeat times and return the median time in ms
+    """
+    times=[]
+    for i in range(repeat):
+        start=time.time()
+        rv=client.get(url)
+        times.append((time.time()-start)*1000)
+        assert rv.status_code==200, url
+    return sorted(times)[len(times)//2]
+
+def bench_stats(args):
+    """Time the statistics for a window of 90 days, for a growing history
+
+    The number of actions per day stays the same, the history gets longer.
+    """
+    print('%6s %9s %14s %14s' %('years', 'actions', 'window (ms)', 'all time (ms)'))
+    for years in args.years:
+        days=years*365
+        db_fd, path=setup_database(days*args.per_day, days)
+        try:
+            client=housechores.app.test_client()
+            login(client)
+            end=date(2010, 1, 1)+timedelta(days=days-1)
+            window='/stats?start=%s&end=%s&granularity=week&format=json' %(end-timedelta(days=90), end)
+            print('%6s %9s %14.2f %14.2f' %(years, days*args.per_day, median_time(client, window, args.repeat), median_time(client, '/stats', args.repeat)))
+        finally:
+            teardown_database(db_fd, path)
+
+def percentile(times, fraction):
+    """Get the value below which fraction of the sorted times fall
+    """
+    return times[min(len(times)-1, int(len(times)*fraction))]
+
+def time_route(client, method, url, data, repeat):
+    """Request a url repeat times
+
+    Returns the p50 and p99 in ms and the number of statements of the last
+    request. data (a function) gives the POST data for every request.
+    """
+    times=[]
+    for i in range(repeat):
+        start=time.time()
+        if method=='POST':
+            rv=client.post(url, data=data())
+        else:
+            rv=client.get(url)
+        #a streamed answer is only generated when it is read
+        rv.get_data()
+        times.append((time.time()-start)*1000)
+        assert rv.status_code in (200, 302), '%s %s: %s' %(method, url, rv.status_code)
+    times.sort()
+    #the statements are counted by the connections of the application
+    return percentile(times, 0.5), percentile(times, 0.99), housechores.sql_tally()[0]
+
+def git_commit():
+    """Get the current commit, or None outside a git checkout
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_routes(args):
+    """Time the main routes on databases of several sizes
+
+    Scale 1 is 1M actions over 5 years, 500 chores and 50 persons. The
+    p50, p99 and the number of SQL statements per request are printed and
+    saved as json (--output), to compare them between commits.
+    """
+    results=[]
+    print('%7s %9s %-40s %10s %10s %6s' %('scale', 'actions', 'route', 'p50 (ms)', 'p99 (ms)', 'sql'))
+    for scale in args.scale:
+        random.seed(args.seed)
+        actions=int(1000000*scale)
+        chores=max(9, int(500*scale))
+        persons=max(4, int(50*scale))
+        db_fd, path=setup_database(actions, 5*365, chores, persons)
+        try:
+            client=housechores.app.test_client()
+            login(client)
+            today=date.today().strftime('%Y-%m-%d')
+            routes=[
+                ('GET', '/overview', None, args.repeat),
+                ('GET', '/overview?chore=1', None, args.repeat),
+                ('GET', '/overview/%s' %(max(1, actions//100)), None, args.repeat),
+                ('GET', '/overview?format=json', None, args.repeat),
+                ('GET', '/overview?search=clean', None, args.repeat),
+                ('GET', '/autocomplete/chores?q=cl', None, args.repeat),
+                ('GET', '/chores_lastaction', None, args.repeat),
+                ('GET', '/stats', None, args.repeat),
+                ('GET', '/stats?granularity=month&format=json', None, args.repeat),
+                ('GET', '/export_xml', None, args.repeat),
+                ('GET', '/download_xml', None, args.export_repeat),
+                ('POST', '/new_action', lambda: dict(date=today, person=random.randint(1, persons), chore=random.randint(1, chores)), args.repeat),
+            ]
+            for method, url, data, repeat in routes:
+                p50, p99, statements=time_route(client, method, url, data, repeat)
+                route='%s %s' %(method, url)
+                print('%7s %9s %-40s %10.2f %10.2f %6s' %(scale, actions, route, p50, p99, statements))
+                results.append(dict(scale=scale, actions=actions, chores=chores, persons=persons, route=route,
+                    repeat=repeat, p50_ms=round(p50, 3), p99_ms=round(p99, 3), statements=statements))
+        finally:
+            teardown_database(db_fd, path)
+    with open(args.output, 'w') as f:
+        json.dump(dict(commit=git_commit(), date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            python=platform.python_version(), sqlite=sqlite3.sqlite_version, seed=args.seed, results=results), f, indent=2, sort_keys=True)
+    print('Saved the results in %s' %(args.output))
+
+def write_actions(seconds, persons, chores):
+    """Add actions (one per request) for some seconds, from this thread
+
+    Returns the times (ms) of the requests that succeeded and the number of
+    failed requests.
+    """
+    client=housechores.app.test_client()
+    login(client)
+    today=date.today().strftime('%Y-%m-%d')
+    times=[]
+    errors=0
+    end=time.time()+seconds
+    while time.time()<end:
+        start=time.time()
+        try:
+            rv=client.post('/new_action', data=dict(date=today, person=random.randint(1, persons), chore=random.randint(1, chores)))
+            ok=rv.status_code==302
+        except Exception:
+            ok=False
+        if ok:
+            times.append((time.time()-start)*1000)
+        else:
+            errors+=1
+    housechores.close_thread_db()
+    return times, errors
+
+def bench_writes(args):
+    """Compare the writes/second of the routes that commit themselves and
+    of the writer thread (WRITE_MODE), for a number of writing threads
+    """
+    config=dict((key, housechores.app.config[key]) for key in ('WRITE_MODE', 'SQLITE_SYNCHRONOUS', 'SQLITE_BUSY_TIMEOUT'))
+    housechores.app.config.update(SQLITE_SYNCHRONOUS=args.synchronous, SQLITE_BUSY_TIMEOUT=args.busy_timeout)
+    print('%-7s %8s %10s %8s %10s %10s' %('mode', 'threads', 'writes/s', 'errors', 'p50 (ms)', 'p99 (ms)'))
+    try:
+        for threads in args.threads:
+            for mode in ('direct', 'writer'):
+                housechores.app.config['WRITE_MODE']=mode
+                db_fd, path=setup_database(1000)
+                try:
+                    results=[]
+                    workers=[threading.Thread(target=lambda: results.append(write_actions(args.seconds, 4, 9))) for i in range(threads)]
+                    for worker in workers:
+                        worker.start()
+                    for worker in workers:
+                        worker.join()
+                    housechores.stop_writer()
+                    times=sorted(t for worker_times, errors in results for t in worker_times)
+                    errors=sum(errors for worker_times, errors in results)
+                    if times:
+                        print('%-7s %8s %10.1f %8s %10.2f %10.2f' %(mode, threads, len(times)/args.seconds, errors, percentile(times, 0.5), percentile(times, 0.99)))
+                    else:
+                        print('%-7s %8s %10.1f %8s' %(mode, threads, 0, errors))
+                finally:
+                    teardown_database(db_fd, path)
+    finally:
+        housechores.app.config.update(config)
+
+def main(argv):
+    """Run one of the benchmarks
+    """
+    parser=argparse.ArgumentParser(description='Benchmarks for housechores.')
+    subparsers=parser.add_subparsers(dest='benchmark')
+    connections=subparsers.add_parser('connections', help='persistent connections against a connection per request')
+    connections.add_argument('--actions', type=int, default=10000, help='number of actions in the database')
+    connections.add_argument('--seconds', type=float, default=5, help='seconds per setup')
+    connections.set_defaults(func=bench_connections)
+    stats=subparsers.add_parser('stats', help='statistics for a window, for a growing history')
+    stats.add_argument('--years', type=int, nargs='+', default=[1, 4, 16], help='years of history')
+    stats.add_argument('--per-day', type=int, default=10, help='actions per day')
+    stats.add_argument('--repeat', type=int, default=50, help='requests per measurement')
+    stats.set_defaults(func=bench_stats)
+    routes=subparsers.add_parser('routes', help='p50, p99 and sql statements of the main routes, for several database sizes')
+    routes.add_argument('--scale', type=float, nargs='+', default=[0.001, 0.01, 0.1], help='scale factors, 1 is 1M actions, 500 chores and 50 persons')
+    routes.add_argument('--repeat', type=int, default=50, help='requests per route')
+    routes.add_argument('--export-repeat', type=int, default=3, help='requests for the xml download')
+    routes.add_argument('--seed', type=int, default=0, help='seed for the random actions')
+    routes.add_argument('--output', default='bench_routes.json', help='json file for the results')
+    routes.set_defaults(func=bench_routes)
+    writes=subparsers.add_parser('writes', help='writes/second with and without the writer thread, for several writing threads')
+    writes.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32], help='writing threads')
+    writes.add_argument('--seconds', type=float, default=5, help='seconds per measurement')
+    writes.add_argument('--synchronous', default='FULL', help='sqlite synchronous pragma (FULL: an fsync per commit)')
+    writes.add_argument('--busy-timeout', type=int, default=housechores.app.config['SQLITE_BUSY_TIMEOUT'], help='sqlite busy_timeout (ms), 0 fails at once on a locked database')
+    writes.set_defaults(func=bench_writes)
+    args=parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    args.func(args)
+
+if __name__=='__main__':
+    main(sys.argv[1:])
@@ -5,7 +5,35 @@ SECRET_KEY='thisisareallysecretkeydon7you71nk'
 USERNAME='admin'
 PASSWORD='admin'
 LOGFILE = 'log.log'
-LOGFILEMODE = 'w'
+LOGFILEMODE = 'a'
 LOGFORMAT = '%(asctime)s - %(funcName)s from %(filename)s line: %(lineno)s - %(levelname)s: %(message)s'
 LOGLEVEL = 'DEBUG'
-XMLEXPORT='export/database_xml'
+PERSISTENT_CONNECTIONS = True
+SQLITE_JOURNAL_MODE = 'WAL'
+SQLITE_SYNCHRONOUS = 'NORMAL'
+SQLITE_BUSY_TIMEOUT = 5000
+SQLITE_CACHE_SIZE = -8000
+SQLITE_MMAP_SIZE = 67108864
+SQLITE_FOREIGN_KEYS = 'ON'
+STATIC_MAX_AGE = 31536000
+COMPRESS_LEVEL = 6
+COMPRESS_MIN_SIZE = 500
+COMPRESS_MIMETYPES = ('text/html', 'text/css', 'text/xml', 'application/json', 'application/javascript')
+GENERATE_MAX_SCALE = 0.1
+METRICS_DIR = None
+METRICS_FLUSH_SECONDS = 5
+METRICS_TOKEN = None
+SLOW_QUERY_SECONDS = 0.1
+SLOW_QUERY_TOP = 20
+AUTOCOMPLETE_LIMIT = 10
+CHANGES_TIMEOUT = 30
+CHANGES_POLL_SECONDS = 1
+ASGI_WORKERS = 8
+MAX_CONNECTIONS = 64
+HOUSEHOLDS_DIR = None
+HOUSEHOLD_FROM = 'subdomain'
+HOUSEHOLD_CREATE = True
+WRITE_MODE = 'direct'
+WRITE_BATCH_SECONDS = 0.002
+WRITE_BATCH_SIZE = 100
+WRITE_TIMEOUT = 10
@@ -1,11 +1,46 @@
 #!/usr/bin/env python
 
 import os
+import re
+import sys
+import csv
+import json
 import sqlite3
+import errno
+import atexit
+import argparse
 import logging
-from datetime import datetime, date
-from flask import Flask, request, session, g, redirect, url_for, abort, render_template, flash, Markup, make_response
-from flask_debugtoolbar import DebugToolbarExtension
+import logging.handlers
+import heapq
+import random
+import bisect
+import threading
+import time
+import gzip
+import hashlib
+import hmac
+import mimetypes
+from io import BytesIO
+from functools import wraps
+from contextlib import contextmanager
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+from xml.sax.saxutils import escape
+from flask import Flask, request, session, g, redirect, url_for, abort, render_template, flash, Markup, Response, stream_with_context, jsonify, make_response, send_file, safe_join, has_request_context
+from werkzeug.http import parse_accept_header
+from werkzeug.datastructures import Headers
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import brotli
+except ImportError:
+    brotli=None
+try:
+    import fcntl
+except ImportError:
+    fcntl=None
 
 #create app
 app = Flask(__name__)
@@ -13,25 +48,815 @@ app = Flask(__name__)
 app.config.from_object('config')
 app.config.from_envvar('HOUSECHORESETTINGS', silent=True)
 app.debug=app.config['DEBUG']
-toolbar=DebugToolbarExtension(app)
+if app.debug:
+    #only for development, it is not needed (or installed) in production
+    from flask_debugtoolbar import DebugToolbarExtension
+    toolbar=DebugToolbarExtension(app)
 
 # SETUP LOGGING
-logging.basicConfig(
-    filename=app.config['LOGFILE'],
-    filemode=app.config['LOGFILEMODE'],
-    format=app.config['LOGFORMAT'],
-    level=app.config['LOGLEVEL']
-)
+#the log records go through a queue to one writer thread, so a request never
+#waits for the file. The WatchedFileHandler opens the file again after
+#logrotate moved it, so all the processes can append to the same log.
+if hasattr(logging.handlers, 'QueueHandler'):
+    QueueHandler=logging.handlers.QueueHandler
+    QueueListener=logging.handlers.QueueListener
+else:
+    #python 2 has no QueueHandler and QueueListener, these do the same
+    class QueueHandler(logging.Handler):
+        """Put the log records on a queue
+        """
+        def __init__(self, queue):
+            logging.Handler.__init__(self)
+            self.queue=queue
+
+        def prepare(self, record):
+            self.format(record)
+            record.msg=record.message
+            record.args=None
+            record.exc_info=None
+            return record
+
+        def emit(self, record):
+            try:
+                self.queue.put_nowait(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+    class QueueListener(object):
+        """Hand the log records on a queue to the handlers, in a thread
+        """
+        def __init__(self, queue, *handlers):
+            self.queue=queue
+            self.handlers=handlers
+            self._thread=None
+
+        def start(self):
+            self._thread=threading.Thread(target=self._monitor)
+            self._thread.daemon=True
+            self._thread.start()
+
+        def _monitor(self):
+            while True:
+                record=self.queue.get()
+                if record is None:
+                    break
+                for handler in self.handlers:
+                    if record.levelno>=handler.level:
+                        handler.handle(record)
+
+        def stop(self):
+            if self._thread:
+                self.queue.put_nowait(None)
+                self._thread.join()
+                self._thread=None
+
+class LogQueueHandler(QueueHandler):
+    """Put the log records on the queue of the writer thread
+
+    The records are formatted by the writer thread, not on the request. A
+    new worker (a fork) starts a writer thread of its own.
+    """
+    def __init__(self, queue, listener):
+        QueueHandler.__init__(self, queue)
+        self.listener=listener
+        self.pid=os.getpid()
+        self.lock_fork=threading.Lock()
+
+    def prepare(self, record):
+        return record
+
+    def emit(self, record):
+        if self.pid!=os.getpid():
+            with self.lock_fork:
+                if self.pid!=os.getpid():
+                    self.listener._thread=None
+                    self.listener.start()
+                    self.pid=os.getpid()
+        QueueHandler.emit(self, record)
+
+def setup_logging():
+    """Log to LOGFILE, at LOGLEVEL, through a queue and one writer thread
+
+    Returns the listener (the writer thread).
+    """
+    handler=logging.handlers.WatchedFileHandler(app.config['LOGFILE'], mode=app.config['LOGFILEMODE'])
+    handler.setFormatter(logging.Formatter(app.config['LOGFORMAT']))
+    log_queue=queue.Queue(-1)
+    listener=QueueListener(log_queue, handler)
+    root=logging.getLogger()
+    root.addHandler(LogQueueHandler(log_queue, listener))
+    root.setLevel(app.config['LOGLEVEL'])
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener=setup_logging()
+
+################################################################################
+# METRICS
+#
+#the metrics are kept per process; with METRICS_DIR every process writes them
+#to a file there (every METRICS_FLUSH_SECONDS), and /metrics adds them all up.
+#The files of the processes that ended are added to retired.json there and
+#removed, so the totals don't go down when mod_wsgi replaces a process.
+METRICS={
+    'housechores_requests_total': ('counter', 'Number of requests per endpoint, method and status'),
+    'housechores_request_duration_seconds': ('histogram', 'Time to answer a request, per endpoint and method'),
+    'housechores_response_size_bytes': ('histogram', 'Size of the (uncompressed, not streamed) answers, per endpoint'),
+    'housechores_sql_statements_total': ('counter', 'Number of SQL statements per endpoint'),
+    'housechores_sql_duration_seconds_total': ('counter', 'Time spent executing SQL statements per endpoint'),
+    'housechores_cache_total': ('counter', 'Lookups in the caches (settings, lookups, etag), per result (hit or miss)'),
+}
+METRICS_BUCKETS={
+    'housechores_request_duration_seconds': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'housechores_response_size_bytes': (256, 1024, 4096, 16384, 65536, 262144, 1048576),
+}
+
+_metrics={'counters': {}, 'histograms': {}, 'slow_queries': {}, 'flushed': 0, 'pid': None, 'started': None}
+_metrics_lock=threading.Lock()
+_sql_tally=threading.local()
+
+def metric_labels(**labels):
+    """Make the label part of a metric: name="value",...
+    """
+    return ','.join('%s="%s"' %(name, ('%s' %(value)).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in sorted(labels.items()))
+
+def inc_counter(name, labels, value=1):
+    """Raise a counter, labels as made by metric_labels
+    """
+    with _metrics_lock:
+        counter=_metrics['counters'].setdefault(name, {})
+        counter[labels]=counter.get(labels, 0)+value
+
+def observe(name, labels, value):
+    """Add a value to a histogram, labels as made by metric_labels
+
+    Kept as the count per bucket (the last one is +Inf), the sum and the
+    count.
+    """
+    buckets=METRICS_BUCKETS[name]
+    with _metrics_lock:
+        histogram=_metrics['histograms'].setdefault(name, {})
+        if labels not in histogram:
+            histogram[labels]=[0]*(len(buckets)+3)
+        values=histogram[labels]
+        values[bisect.bisect_left(buckets, value)]+=1
+        values[-2]+=value
+        values[-1]+=1
+
+CACHE_HIT={
+    'settings': metric_labels(cache='settings', result='hit'),
+    'lookups': metric_labels(cache='lookups', result='hit'),
+    'etag': metric_labels(cache='etag', result='hit'),
+}
+CACHE_MISS={
+    'settings': metric_labels(cache='settings', result='miss'),
+    'lookups': metric_labels(cache='lookups', result='miss'),
+    'etag': metric_labels(cache='etag', result='miss'),
+}
+
+def count_cache(cache, hit):
+    """Count a hit or miss of one of the caches
+    """
+    inc_counter('housechores_cache_total', CACHE_HIT[cache] if hit else CACHE_MISS[cache])
+
+def sql_tally():
+    """Get the number of SQL statements and the seconds spent on them, for
+    the current (or last) request of this thread
+    """
+    return getattr(_sql_tally, 'statements', 0), getattr(_sql_tally, 'seconds', 0.0)
+
+def record_slow_query(sql, params, seconds, plan):
+    """Log a statement that took SLOW_QUERY_SECONDS or longer, and keep it
+
+    Per statement the number of slow runs and their time are kept, with the
+    parameter types, the query plan and the endpoint of the slowest run. Only the
+    SLOW_QUERY_TOP slowest statements are kept.
+    """
+    sql=' '.join(sql.split())
+    endpoint=request.endpoint if has_request_context() else None
+    logging.warning('Slow query (%.3f s) from endpoint %s: %s parameters: %s plan: %s', seconds, endpoint, sql, params, plan)
+    with _metrics_lock:
+        slow=_metrics['slow_queries']
+        if sql not in slow:
+            slow[sql]=dict(sql=sql, count=0, seconds=0.0, max_seconds=0.0)
+        query=slow[sql]
+        query['count']+=1
+        query['seconds']+=seconds
+        if seconds>=query['max_seconds']:
+            query.update(max_seconds=seconds, params=params, plan=plan, endpoint=endpoint, time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        if len(slow)>app.config['SLOW_QUERY_TOP']:
+            del slow[min(slow, key=lambda sql: slow[sql]['max_seconds'])]
+
+def slow_queries():
+    """Get the slow statements of all the processes, the slowest first
+    """
+    queries=sorted(collect_metrics()['slow_queries'].values(), key=lambda query: query['max_seconds'], reverse=True)
+    return queries[:app.config['SLOW_QUERY_TOP']]
+
+def flush_metrics(force=False):
+    """Write the metrics of this process to METRICS_DIR/<pid>-<start>.json
+
+    At most once per METRICS_FLUSH_SECONDS, unless forced. With the start
+    time in the name, a new process with the pid of an old one does not
+    overwrite its file. The file is written next to its place and then
+    renamed, so a reader never sees half a file.
+    """
+    folder=app.config.get('METRICS_DIR')
+    if not folder or (not force and time.time()-_metrics['flushed']<app.config['METRICS_FLUSH_SECONDS']):
+        return
+    with _metrics_lock:
+        if _metrics['pid']!=os.getpid():
+            _metrics['pid']=os.getpid()
+            _metrics['started']=time.time()
+        data=json.dumps(dict(counters=_metrics['counters'], histograms=_metrics['histograms'], slow_queries=_metrics['slow_queries']))
+        _metrics['flushed']=time.time()
+        path=os.path.join(folder, '%s-%d.json' %(_metrics['pid'], _metrics['started']*1000))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path + '.tmp', 'w') as f:
+        f.write(data)
+    os.rename(path + '.tmp', path)
+
+def process_running(pid):
+    """Tell if there is a process with this pid (maybe a new one with the
+    pid of an old one)
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno!=errno.ESRCH
+    return True
+
+def read_metrics(path):
+    """Read a metrics file, None when it can't be read
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        logging.warning('Could not read the metrics in %s', path)
+        return None
+
+def add_metrics(total, data):
+    """Add the metrics in data (of one process) to total
+    """
+    for name, counter in data['counters'].items():
+        for labels, value in counter.items():
+            total['counters'].setdefault(name, {})
+            total['counters'][name][labels]=total['counters'][name].get(labels, 0)+value
+    for name, histogram in data['histograms'].items():
+        for labels, values in histogram.items():
+            current=total['histograms'].setdefault(name, {}).setdefault(labels, [0]*len(values))
+            total['histograms'][name][labels]=[a+b for a, b in zip(current, values)]
+    for sql, query in data.get('slow_queries', {}).items():
+        current=total['slow_queries'].get(sql)
+        if current is None:
+            total['slow_queries'][sql]=query
+        else:
+            slowest=dict(query if query['max_seconds']>current['max_seconds'] else current)
+            slowest.update(count=current['count']+query['count'], seconds=current['seconds']+query['seconds'])
+            total['slow_queries'][sql]=slowest
+    return total
+
+@contextmanager
+def metrics_dir_lock(folder):
+    """Keep the other processes out of METRICS_DIR (where there is fcntl),
+    while the files are retired and read
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(folder, 'metrics.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def retire_metrics(folder):
+    """Add the files of the processes that ended to retired.json, and remove
+    them; call with metrics_dir_lock
+
+    A file stays while its pid runs, also when that is a new process with
+    the pid. Without fcntl (so without the lock) the files stay.
+    """
+    if fcntl is None:
+        return
+    ended=[filename for filename in os.listdir(folder)
+        if re.match(r'^[0-9]+(-[0-9]+)?\.json$', filename) and not process_running(int(re.match('[0-9]+', filename).group()))]
+    if not ended:
+        return
+    path=os.path.join(folder, 'retired.json')
+    retired=read_metrics(path) if os.path.isfile(path) else None
+    retired=retired or dict(counters={}, histograms={}, slow_queries={})
+    for filename in ended:
+        data=read_metrics(os.path.join(folder, filename))
+        if data is not None:
+            add_metrics(retired, data)
+    with open(path + '.tmp', 'w') as f:
+        f.write(json.dumps(retired))
+    os.rename(path + '.tmp', path)
+    for filename in ended:
+        os.remove(os.path.join(folder, filename))
+    logging.info('Retired the metrics of %s processes that ended', len(ended))
+
+def collect_metrics():
+    """Get the metrics of all the processes (or only this one without
+    METRICS_DIR), added up
+    """
+    folder=app.config.get('METRICS_DIR')
+    if not folder:
+        with _metrics_lock:
+            return json.loads(json.dumps(dict(counters=_metrics['counters'], histograms=_metrics['histograms'], slow_queries=_metrics['slow_queries'])))
+    flush_metrics(force=True)
+    total=dict(counters={}, histograms={}, slow_queries={})
+    with metrics_dir_lock(folder):
+        retire_metrics(folder)
+        for filename in os.listdir(folder):
+            if not filename.endswith('.json'):
+                continue
+            data=read_metrics(os.path.join(folder, filename))
+            if data is not None:
+                add_metrics(total, data)
+    return total
+
+def render_metrics(metrics):
+    """Write the metrics in the Prometheus text format
+    """
+    lines=[]
+    for name in sorted(METRICS):
+        kind, description=METRICS[name]
+        lines.append('# HELP %s %s' %(name, description))
+        lines.append('# TYPE %s %s' %(name, kind))
+        if kind=='counter':
+            for labels, value in sorted(metrics['counters'].get(name, {}).items()):
+                lines.append('%s{%s} %s' %(name, labels, value))
+        else:
+            buckets=METRICS_BUCKETS[name]
+            for labels, values in sorted(metrics['histograms'].get(name, {}).items()):
+                separator=',' if labels else ''
+                cumulative=0
+                for bucket, count in zip([repr(float(bucket)) for bucket in buckets] + ['+Inf'], values):
+                    cumulative+=count
+                    lines.append('%s_bucket{%s%sle="%s"} %s' %(name, labels, separator, bucket, cumulative))
+                lines.append('%s_sum{%s} %s' %(name, labels, repr(float(values[-2]))))
+                lines.append('%s_count{%s} %s' %(name, labels, values[-1]))
+    return '\n'.join(lines) + '\n'
+
+@app.before_request
+def start_metrics():
+    """Start the clock and the SQL tally of a request
+
+    This is registered before the login check, so it runs first.
+    """
+    _sql_tally.statements=0
+    _sql_tally.seconds=0.0
+    _sql_tally.start=time.time()
+
+@app.after_request
+def record_metrics(response):
+    """Record the time, size and SQL statements of a request
+    """
+    size=None if response.is_streamed else response.content_length
+    record_request(response.status_code, size)
+    return response
+
+@app.teardown_request
+def record_failed_metrics(error):
+    """Record a request that raised: after_request does not run for it, the
+    answer is a 500
+    """
+    if error is not None:
+        record_request(500, None)
+
+def record_request(status, size):
+    """Record a request once, with its status and size (None when unknown)
+    """
+    start=getattr(_sql_tally, 'start', None)
+    if start is None:
+        return
+    _sql_tally.start=None
+    endpoint=request.endpoint or 'none'
+    labels=metric_labels(endpoint=endpoint, method=request.method)
+    observe('housechores_request_duration_seconds', labels, time.time()-start)
+    inc_counter('housechores_requests_total', metric_labels(endpoint=endpoint, method=request.method, status=status))
+    if size is not None:
+        observe('housechores_response_size_bytes', metric_labels(endpoint=endpoint), size)
+    labels=metric_labels(endpoint=endpoint)
+    inc_counter('housechores_sql_statements_total', labels, _sql_tally.statements)
+    inc_counter('housechores_sql_duration_seconds_total', labels, _sql_tally.seconds)
+    flush_metrics()
+
+################################################################################
+# DATES
+#
+#the dates are kept as julian day numbers: in sqlite date(action_date) gives
+#the yyyy-mm-dd back
+JULIAN_DAY_OFFSET=1721425
+DATE_FORMATS=('%Y-%m-%d', '%d-%m-%Y')
+
+def day_number(value):
+    """Get the julian day number of a date, or of a text in one of the
+    DATE_FORMATS. Raises ValueError for anything else.
+    """
+    if not isinstance(value, date):
+        for the_format in DATE_FORMATS:
+            try:
+                value=datetime.strptime(value, the_format).date()
+                break
+            except (TypeError, ValueError):
+                pass
+        else:
+            raise ValueError('not a valid date (yyyy-mm-dd): %s' %(value))
+    return value.toordinal() + JULIAN_DAY_OFFSET
+
+################################################################################
+# DATABASE CONNECTIONS
+#
+SQLITE_PRAGMAS=('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size', 'foreign_keys')
+
+#only these statements get a query plan
+EXPLAIN_STATEMENTS=re.compile(r'\s*(select|with|insert|update|delete|replace)\b', re.IGNORECASE)
+
+def explain_query_plan(database, sql, params=()):
+    """Get the query plan of a statement, one line per step
+
+    The plan is asked on a connection of its own: an explain on the
+    connection of the statement would commit its transaction in python 2.
+    """
+    if not EXPLAIN_STATEMENTS.match(sql) or database in (None, ':memory:'):
+        return None
+    try:
+        db=sqlite3.connect(database)
+        try:
+            rows=db.execute('explain query plan ' + sql, params).fetchall()
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        return 'no plan: %s' %(e)
+    return '\n'.join(row[-1] for row in rows)
+
+class MetricsCursor(sqlite3.Cursor):
+    """A cursor that counts its statements and their time, see sql_tally
+
+    A statement that takes SLOW_QUERY_SECONDS or longer is kept with its
+    parameters and query plan, see record_slow_query.
+    """
+    def timed(self, method, args, kwargs):
+        start=time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            seconds=time.time()-start
+            _sql_tally.statements=getattr(_sql_tally, 'statements', 0)+1
+            _sql_tally.seconds=getattr(_sql_tally, 'seconds', 0.0)+seconds
+            threshold=app.config.get('SLOW_QUERY_SECONDS')
+            if threshold is not None and seconds>=threshold and args:
+                self.slow_query(method, args, seconds)
+
+    def slow_query(self, method, args, seconds):
+        """Keep a slow statement, the executemany and executescript ones
+        without parameters and plan
+
+        Only the types of the parameters are kept, not their values: they
+        can be passwords (check_login, edit_user).
+        """
+        sql=args[0]
+        params=args[1] if len(args)>1 else ()
+        if method is sqlite3.Cursor.execute:
+            plan=explain_query_plan(getattr(self.connection, 'database', None), sql, params)
+            params=param_types(params)
+        else:
+            plan=None
+            params=method.__name__
+        record_slow_query(sql, params, seconds, plan)
+
+    def execute(self, *args, **kwargs):
+        return self.timed(sqlite3.Cursor.execute, args, kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.timed(sqlite3.Cursor.executemany, args, kwargs)
+
+    def executescript(self, *args, **kwargs):
+        return self.timed(sqlite3.Cursor.executescript, args, kwargs)
+
+def param_types(params):
+    """Describe the parameters of a statement by their types only, like
+    (int, str) or {name: str}
+    """
+    if isinstance(params, dict):
+        return '{%s}' %(', '.join('%s: %s' %(name, type(params[name]).__name__) for name in sorted(params)))
+    return '(%s)' %(', '.join(type(param).__name__ for param in params))
+
+class MetricsConnection(sqlite3.Connection):
+    """A connection that counts its statements and their time, see sql_tally
+
+    executemany and executescript count as one statement. The time is the
+    time in execute, which includes fetching the first row.
+    """
+    def __init__(self, database, *args, **kwargs):
+        sqlite3.Connection.__init__(self, database, *args, **kwargs)
+        #for the query plans of the slow statements
+        self.database=database
+
+    def cursor(self, factory=MetricsCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.cursor().executemany(*args, **kwargs)
+
+    def executescript(self, *args, **kwargs):
+        return self.cursor().executescript(*args, **kwargs)
+
+#the class of the connections
+CONNECTION_CLASS=MetricsConnection
+
+_connections=threading.local()
+_forked_connections=[]
+
+def connect_db(database):
+    """Open a new connection to the database
+
+    And apply the SQLITE_* pragmas from the config (None skips a pragma).
+    """
+    db=sqlite3.connect(database, factory=CONNECTION_CLASS)
+    db.row_factory=sqlite3.Row #using row_factory to obtain column_names when we ask for data
+    for pragma in SQLITE_PRAGMAS:
+        value=app.config.get('SQLITE_' + pragma.upper())
+        if value is not None:
+            db.execute('pragma %s=%s' %(pragma, value))
+    logging.debug('Opened database: %s', database)
+    return db
+
+def get_thread_db(database):
+    """Get the connection of this thread to the database, open it on first use
+
+    The connections stay open for the next requests in this thread, at most
+    MAX_CONNECTIONS of them: the one used longest ago is closed first. The
+    connections inherited from the parent process of a forked worker are
+    left alone (closing them could release the locks of the parent), and
+    new ones are opened.
+    """
+    pool=getattr(_connections, 'pool', None)
+    if pool is None or _connections.pid!=os.getpid():
+        if pool:
+            _forked_connections.extend(pool.values())
+        pool=_connections.pool=OrderedDict()
+        _connections.pid=os.getpid()
+    db=pool.pop(database, None)
+    if db is None:
+        while pool and len(pool)>=app.config['MAX_CONNECTIONS']:
+            old_database, old_db=pool.popitem(last=False)
+            logging.debug('Closing the connection to %s, used longest ago', old_database)
+            old_db.close()
+        db=connect_db(database)
+    pool[database]=db
+    return db
+
+def close_thread_db():
+    """Close the connections of this thread
+    """
+    pool=getattr(_connections, 'pool', None)
+    if pool and _connections.pid==os.getpid():
+        for db in pool.values():
+            db.close()
+    _connections.pool=None
 
 def get_db():
-    """Connects to the database
+    """Connects to the database (of the household, see current_database)
+
+    With PERSISTENT_CONNECTIONS every thread keeps its connections open
+    between requests, otherwise a connection is opened per request. The
+    database of a household is set up on first use, see setup_household.
     """
     if not hasattr(g, 'db'):
-        g.db= sqlite3.connect(app.config['DATABASE'])
-        g.db.row_factory=sqlite3.Row #using row_factory to obtain column_names when we ask for data
-        logging.debug('Getting database: ' + app.config['DATABASE'])
+        database=current_database()
+        if app.config.get('HOUSEHOLDS_DIR') and database not in _ready_households:
+            setup_household(database)
+        else:
+            g.db=open_db(database)
+        logging.debug('Getting database: %s', database)
     return g.db
 
+def open_db(database):
+    """Get a connection of this thread, or a new one without
+    PERSISTENT_CONNECTIONS
+    """
+    if app.config['PERSISTENT_CONNECTIONS']:
+        return get_thread_db(database)
+    return connect_db(database)
+
+################################################################################
+# HOUSEHOLDS
+#
+#with HOUSEHOLDS_DIR every household has a database of its own there, so the
+#households don't wait for each other's writes. The household comes from the
+#subdomain (smiths.example.com) or from the login (HOUSEHOLD_FROM).
+HOUSEHOLD_KEY=re.compile(r'^[a-z0-9][a-z0-9-]{0,62}$')
+
+_ready_households=set()
+_households_lock=threading.Lock()
+
+def get_household():
+    """Get the household of the request, from the subdomain or the session
+    (see HOUSEHOLD_FROM). None when there is none or it is not valid.
+    """
+    if app.config['HOUSEHOLD_FROM']=='session':
+        household=session.get('household')
+    else:
+        household=request.host.split(':')[0].split('.')[0].lower()
+    return household if household and HOUSEHOLD_KEY.match(household) else None
+
+def current_database():
+    """Get the database file of the current household
+
+    Without HOUSEHOLDS_DIR there is one database for all: DATABASE.
+    """
+    folder=app.config.get('HOUSEHOLDS_DIR')
+    if not folder:
+        return app.config['DATABASE']
+    household=g.get('household')
+    if household is None:
+        abort(404)
+    return os.path.join(folder, household + '.db')
+
+@contextmanager
+def household_lock(database):
+    """Keep the other threads, and the other processes (where there is
+    fcntl), out of the database of a household while it is set up
+    """
+    with _households_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(database + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def setup_household(database):
+    """Create or migrate the database of a household, on its first use in
+    this process
+
+    A new database (only with HOUSEHOLD_CREATE, otherwise 404) gets the
+    tables and the default admin account; an existing one is migrated to
+    the current version. The connection is kept as g.db.
+    """
+    folder=app.config['HOUSEHOLDS_DIR']
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    with household_lock(database):
+        new=not os.path.isfile(database)
+        if new and not app.config['HOUSEHOLD_CREATE']:
+            logging.warning('Unknown household: %s', g.household)
+            abort(404)
+        g.db=open_db(database)
+        if new:
+            logging.warning('Creating the database of household %s', g.household)
+            init_the_db()
+        else:
+            migrate_the_db()
+    _ready_households.add(database)
+
+################################################################################
+# WRITES
+#
+#with WRITE_MODE='writer' the routes don't commit themselves: their writes go
+#to one writer thread (per process), that commits everything that came in
+#within WRITE_BATCH_SECONDS in one transaction. This needs journal_mode=WAL,
+#so the readers don't hold up the writer. The set up and maintenance of a
+#database (init_the_db, migrate_the_db, rebuild_summaries, and
+#generate_actions that commits in batches of its own) don't go through it.
+class PendingWrite(object):
+    """A write for the writer thread: func(db) on a database, with its
+    result (or error) once it is committed
+    """
+    def __init__(self, database, func):
+        self.database=database
+        self.func=func
+        self.result=None
+        self.error=None
+        self.done=threading.Event()
+
+_writer={'pid': None, 'queue': None, 'thread': None}
+_writer_lock=threading.Lock()
+
+def write(func):
+    """Run func(db) in a transaction of its own and commit it
+
+    Returns what func returns; when func raises, its changes are rolled back
+    and the exception is raised here. func should only use db: with
+    WRITE_MODE='writer' it runs in the writer thread, while the request
+    waits (at most WRITE_TIMEOUT seconds) for the commit.
+    """
+    if app.config['WRITE_MODE']!='writer':
+        db=get_db()
+        try:
+            result=func(db)
+        except:
+            db.rollback()
+            raise
+        db.commit()
+        return result
+    #a household is set up before its first write
+    get_db()
+    pending=PendingWrite(current_database(), func)
+    writer_queue().put(pending)
+    if not pending.done.wait(app.config['WRITE_TIMEOUT']):
+        raise RuntimeError('the write was not committed within %s seconds' %(app.config['WRITE_TIMEOUT']))
+    if pending.error is not None:
+        raise pending.error
+    return pending.result
+
+def writer_queue():
+    """Get the queue of the writer thread, start it on first use (also in a
+    forked worker, where the thread of the parent does not run)
+    """
+    with _writer_lock:
+        if _writer['pid']!=os.getpid():
+            _writer['queue']=queue.Queue()
+            _writer['thread']=threading.Thread(target=run_writer, args=(_writer['queue'],), name='housechores-writer')
+            _writer['thread'].daemon=True
+            _writer['thread'].start()
+            _writer['pid']=os.getpid()
+        return _writer['queue']
+
+def stop_writer():
+    """Let the writer thread commit what is queued, and stop it
+    """
+    with _writer_lock:
+        if _writer['pid']==os.getpid():
+            _writer['queue'].put(None)
+            _writer['thread'].join()
+        _writer.update(pid=None, queue=None, thread=None)
+
+atexit.register(stop_writer)
+
+def run_writer(writes):
+    """The writer thread: take the writes in batches, until a None
+
+    A batch is what comes in within WRITE_BATCH_SECONDS after its first
+    write, at most WRITE_BATCH_SIZE writes.
+    """
+    running=True
+    while running:
+        batch=[writes.get()]
+        deadline=time.time()+app.config['WRITE_BATCH_SECONDS']
+        while batch[-1] is not None and len(batch)<app.config['WRITE_BATCH_SIZE']:
+            try:
+                batch.append(writes.get(timeout=max(0, deadline-time.time())))
+            except queue.Empty:
+                break
+        if batch[-1] is None:
+            running=False
+            batch.pop()
+        databases=OrderedDict()
+        for pending in batch:
+            databases.setdefault(pending.database, []).append(pending)
+        for database, pendings in databases.items():
+            commit_writes(database, pendings)
+    close_thread_db()
+
+def commit_writes(database, pendings):
+    """Run the writes for one database in one transaction
+
+    Every write gets a savepoint, so one that fails is rolled back on its
+    own. When the transaction itself fails, all of them get that error.
+    """
+    try:
+        db=get_thread_db(database)
+        #the transaction is begun and committed here, not by the sqlite3 module
+        db.isolation_level=None
+        db.execute('begin immediate')
+        for pending in pendings:
+            db.execute('savepoint pending_write')
+            try:
+                pending.result=pending.func(db)
+            except Exception as e:
+                db.execute('rollback to pending_write')
+                pending.error=e
+            db.execute('release pending_write')
+        db.execute('commit')
+        logging.debug('Committed %s writes to %s', len(pendings), database)
+    except Exception as e:
+        logging.error('Could not commit %s writes to %s: %s', len(pendings), database, e)
+        try:
+            db.execute('rollback')
+        except Exception:
+            pass
+        for pending in pendings:
+            pending.result=None
+            pending.error=pending.error or e
+    for pending in pendings:
+        pending.done.set()
+
 def init_the_db():
     """Initialise the database
     
@@ -41,25 +866,202 @@ def init_the_db():
     with app.open_resource('../sql/create_tables.sql','r') as f:
         logging.warning('performing initdb: create_tables.sql')
         db.cursor().executescript(f.read())
+        #start the change counter at a new value, so old ETags don't match the new database
+        db.execute("update meta set message=? where key='change_counter'", [str(int(time.time()))])
         db.commit()
+    invalidate_settings(current_database())
+
+def get_migrations():
+    """Find the migration scripts in the sql directory
 
-def get_chores():
-    """Get a list of the current chores
+    Returns a dict with {from_version: (to_version, filename)}
+    """
+    migrations={}
+    for filename in os.listdir(os.path.join(app.root_path, '..', 'sql')):
+        match=re.match(r'update_db_from_(.+)_to_(.+)\.sql$', filename)
+        if match:
+            migrations[match.group(1)]=(match.group(2), filename)
+    return migrations
+
+def migrate_the_db():
+    """Bring the database up to date
+
+    Runs the update_db_from_<x>_to_<y>.sql scripts one after the other,
+    starting at the dbversion in the meta table, and converts the dates
+    that are still text. Returns the new dbversion.
     """
     db=get_db()
-    cursor=db.execute('select * from chores where id>=0')
-    rows=cursor.fetchall()
-    logging.debug('Getting the chores list')
-    return rows
+    try:
+        version=db.execute("select message from meta where key='dbversion'").fetchone()[0]
+    except sqlite3.OperationalError:
+        #the meta table came with 0.2.1, the scripts before that are safe to rerun
+        version='0.1'
+    migrations=get_migrations()
+    while version in migrations:
+        new_version, filename=migrations[version]
+        with app.open_resource('../sql/' + filename,'r') as f:
+            logging.warning('migrating the database from %s to %s', version, new_version)
+            db.cursor().executescript(f.read())
+            db.commit()
+        version=new_version
+    convert_action_dates(db)
+    invalidate_settings(current_database())
+    return version
 
-def get_users():
-    """Get a list of the current users
+def convert_action_dates(db, batch_size=1000):
+    """Convert the text dates (yyyy-mm-dd) of the actions to day numbers
+
+    Before 0.5 the dates were kept as text. These are converted batch_size
+    actions at a time, with a commit after every batch, so the database
+    stays usable in between. Text sorts after all numbers in sqlite, so the
+    actions_date index finds the ones left. Dates that can't be read become
+    null. The summary tables are rebuilt afterwards.
+    Returns the number of converted actions.
+    """
+    converted=0
+    while True:
+        rows=db.execute("select id, action_date from actions where action_date >= '' limit ?", [batch_size]).fetchall()
+        if not rows:
+            break
+        updates=[]
+        for id, action_date in rows:
+            try:
+                updates.append((day_number(action_date), id))
+            except ValueError:
+                logging.warning('Action %s has no valid date: %s', id, action_date)
+                updates.append((None, id))
+        db.executemany('update actions set action_date=? where id=?', updates)
+        db.commit()
+        converted+=len(updates)
+    if converted:
+        logging.warning('converted the dates of %s actions', converted)
+        rebuild_summaries()
+    return converted
+
+def rebuild_summaries():
+    """Rebuild the summary tables from the actions
+
+    The summary tables are kept up to date by triggers; this repairs them
+    if they ever drift.
     """
     db=get_db()
-    cursor=db.execute('select * from persons where id>=0')
-    rows=cursor.fetchall()
-    logging.debug('Getting the persons list')
-    return rows
+    with app.open_resource('../sql/rebuild_summaries.sql','r') as f:
+        logging.warning('rebuilding the summary tables')
+        db.cursor().executescript(f.read())
+        db.commit()
+
+################################################################################
+# SETTINGS
+#
+#per database: the connection that watches it, its data_version and the settings
+_settings=OrderedDict()
+_settings_lock=threading.Lock()
+_settings_pid={'pid': os.getpid()}
+
+def forget_forked_settings():
+    """In a forked worker, leave the watch connections of the parent alone
+    (like get_thread_db does) and start again; call with _settings_lock
+    """
+    if _settings_pid['pid']!=os.getpid():
+        _forked_connections.extend(settings['watch'] for settings in _settings.values())
+        _settings.clear()
+        _settings_pid['pid']=os.getpid()
+
+def get_settings():
+    """Get the settings (the key/message pairs) from the meta table
+
+    The settings are kept per process. A separate connection watches the
+    database with PRAGMA data_version, which changes whenever another
+    connection (in this or another process) commits. Only then the meta
+    table is read again. They are kept for MAX_CONNECTIONS databases.
+    """
+    database=current_database()
+    #the database of a household is set up before it is watched
+    db=get_db()
+    with _settings_lock:
+        forget_forked_settings()
+        settings=_settings.pop(database, None)
+        if settings is None:
+            while _settings and len(_settings)>=app.config['MAX_CONNECTIONS']:
+                _settings.popitem(last=False)[1]['watch'].close()
+            settings={'watch': sqlite3.connect(database, check_same_thread=False), 'data_version': None, 'values': None}
+        _settings[database]=settings
+        data_version=settings['watch'].execute('pragma data_version').fetchone()[0]
+        hit=settings['values'] is not None and settings['data_version']==data_version
+        count_cache('settings', hit)
+        if not hit:
+            logging.debug('Loading the settings from the meta table')
+            rows=db.execute('select key, message from meta').fetchall()
+            settings['values']=dict((row[0], row[1]) for row in rows)
+            settings['data_version']=data_version
+        return settings['values']
+
+def invalidate_settings(database=None):
+    """Forget the cached settings and lookups of a database (or of all of
+    them), they are read again on next use
+    """
+    with _settings_lock:
+        forget_forked_settings()
+        for key in list(_settings):
+            if database in (None, key):
+                _settings.pop(key)['watch'].close()
+    with _lookups_lock:
+        for key in list(_lookups):
+            if database in (None, key):
+                del _lookups[key]
+
+################################################################################
+# LOOKUPS
+#
+LOOKUPS={
+    'chores': 'select * from chores where id>=0',
+    'persons': 'select * from persons where id>=0',
+}
+
+#per database: the lookup_version and the values
+_lookups=OrderedDict()
+_lookups_lock=threading.RLock()
+
+def cached_lookup(name, loader):
+    """Get a cached value, made by loader() on first use
+
+    The values are kept per process as long as the lookup_version in the
+    meta table stays the same. The triggers on chores and persons raise it,
+    so a change made in any process is seen by all of them. They are kept
+    for MAX_CONNECTIONS databases.
+    """
+    database=current_database()
+    version=get_settings().get('lookup_version')
+    with _lookups_lock:
+        lookups=_lookups.pop(database, None)
+        if lookups is None or lookups[0]!=version:
+            lookups=(version, {})
+        while _lookups and len(_lookups)>=app.config['MAX_CONNECTIONS']:
+            _lookups.popitem(last=False)
+        _lookups[database]=lookups
+        values=lookups[1]
+        count_cache('lookups', name in values)
+        if name not in values:
+            values[name]=loader()
+        return values[name]
+
+def get_lookup(table):
+    """Get the rows of a lookup table (chores or persons)
+    """
+    def loader():
+        logging.debug('Loading the %s list', table)
+        return get_db().execute(LOOKUPS[table]).fetchall()
+    return cached_lookup(table, loader)
+
+@app.template_global()
+def lookup_options(table, value='id'):
+    """Get the <option>s for a select of the chores or persons, with the id
+    or the name as value. They are made once per lookup_version.
+    """
+    def loader():
+        option=Markup(u"<option value='{0}'>{1}</option>")
+        return Markup(u'').join(option.format(row[value], row['name']) for row in get_lookup(table))
+    return cached_lookup('%s_options_%s' %(table, value), loader)
 
 def get_users_role():
     """Get a list of the users and their roles
@@ -86,7 +1088,7 @@ def get_userid(name):
         db=get_db()
         cursor = db.execute('select id from persons where name=?',[name])
         row=cursor.fetchone()
-        logging.debug('Getting the userid for user: ' + name)
+        logging.debug('Getting the userid for user: %s', name)
         return row[0]
     except:
         logging.critical('Error with getting userid from database')
@@ -97,7 +1099,7 @@ def get_choreid(chore):
     """
     try:
         db=get_db()
-        logging.debug('getting the chore_id for a specific chore: ' + chore)
+        logging.debug('getting the chore_id for a specific chore: %s', chore)
         cursor = db.execute('select id from chores where name=?',[chore])
         row=cursor.fetchone()
         return row[0]
@@ -109,7 +1111,7 @@ def check_login(user, password):
     """Check the provided username and password
     """
     db=get_db()
-    logging.debug('Checking user and password: ' + user + ', ' + password)
+    logging.debug('Checking the password of user: %s', user)
     cur=db.execute('select id from persons where name=? and password=?',[user.lower(), password])
     row=cur.fetchone()
     if row:
@@ -119,12 +1121,434 @@ def check_login(user, password):
 
 def check_admin(userid):
     """Check if current user had admin rights.
+
+    The answer is kept on g for the rest of the request. For the logged in
+    user it is also kept in the session, together with the role_version
+    from the meta table and the database. edit_user and delete_user raise
+    the role_version, so the role is looked up again after any change to
+    the users; the same uid in another household is another user.
     """
-    db=get_db()
-    cur=db.execute('select role_name from users where person_id=?', [userid])
-    row=cur.fetchone()
-    logging.debug('Role of current user: ' + row[0])
-    return row[0]=='admin'
+    if not hasattr(g, 'is_admin'):
+        g.is_admin={}
+    if userid not in g.is_admin:
+        role_version=get_settings().get('role_version')
+        role=session.get('role')
+        if (role_version is not None and role and role['uid']==userid and role['version']==role_version
+                and role.get('database')==current_database()):
+            g.is_admin[userid]=role['admin']
+        else:
+            db=get_db()
+            cur=db.execute('select role_name from users where person_id=?', [userid])
+            row=cur.fetchone()
+            logging.debug('Role of current user: %s', row[0])
+            g.is_admin[userid]=row[0]=='admin'
+            if session.get('uid')==userid:
+                session['role']=dict(uid=userid, version=role_version, database=current_database(), admin=g.is_admin[userid])
+    return g.is_admin[userid]
+
+def bump_role_version(db):
+    """Raise the role_version in the meta table
+
+    This makes every session look up its role again.
+    """
+    db.execute("update meta set message=message+1 where key='role_version'")
+
+################################################################################
+# SEARCH
+#
+#the chore names are in a full text index (chores_fts), kept up to date by
+#the triggers on chores
+def fts_query(text):
+    """Make a prefix query on the full text index of the words in text:
+    every word has to be there, as given or as the start of a longer one.
+    None when there are no words.
+    """
+    words=re.findall(r'\w+', text, re.UNICODE)
+    if not words:
+        return None
+    return ' '.join('"%s"*' %(word) for word in words)
+
+def search_chores(db, text, limit):
+    """Find the chores with the words in text (see fts_query), the best
+    match first
+    """
+    query=fts_query(text)
+    if query is None:
+        return []
+    return db.execute('select rowid as id, name from chores_fts where chores_fts match ? and rowid>=0 order by rank limit ?', [query, limit]).fetchall()
+
+################################################################################
+# IMPORT
+#
+IMPORT_COLUMNS=('date', 'person', 'chore')
+
+def to_text(value):
+    """Decode the bytes read from an import file as utf-8
+    """
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def read_import_file(f, the_format):
+    """Read the records from a csv or ndjson file, one line at a time
+
+    Yields (line number, record) with the record a dict with date, person
+    and chore, or the error for that line as a string. A csv file may start
+    with a header row, otherwise the columns are date, person, chore.
+    """
+    if the_format=='csv':
+        #the csv module of python 3 reads text, the one of python 2 bytes
+        reader=csv.reader(f if sys.version_info[0]==2 else (to_text(line) for line in f))
+        columns=IMPORT_COLUMNS
+        for row in reader:
+            row=[to_text(value).strip() for value in row]
+            if not any(row):
+                continue
+            if reader.line_num==1 and set(IMPORT_COLUMNS)<=set(row):
+                columns=row
+                continue
+            if len(row)!=len(columns):
+                yield reader.line_num, 'expected %s columns, got %s' %(len(columns), len(row))
+            else:
+                yield reader.line_num, dict(zip(columns, row))
+    else:
+        for number, line in enumerate(f, 1):
+            line=to_text(line).strip()
+            if not line:
+                continue
+            try:
+                record=json.loads(line)
+            except ValueError:
+                yield number, 'not valid json'
+                continue
+            yield number, record if isinstance(record, dict) else 'not a json object'
+
+def import_actions(db, f, the_format, batch_size=500, max_errors=100):
+    """Import the actions from a csv or ndjson file
+
+    The persons and chores are looked up by name in maps that are loaded
+    once. The rows are inserted with executemany in batches of batch_size.
+    Rows with errors are skipped; the first max_errors are reported. This
+    does not commit: run it with write, so the import is one transaction.
+
+    Returns (number of imported actions, number of errors, errors) with
+    errors a list of (line number, message).
+    """
+    persons=dict((row[1], row[0]) for row in db.execute('select id, name from persons'))
+    chores=dict((row[1], row[0]) for row in db.execute('select id, name from chores'))
+    imported=0
+    number_of_errors=0
+    errors=[]
+    batch=[]
+    try:
+        for line, record in read_import_file(f, the_format):
+            if not isinstance(record, dict):
+                error=record
+            elif any(not record.get(column) or not isinstance(record[column], type(u'')) for column in IMPORT_COLUMNS):
+                error='date, person and chore are required'
+            elif record['person'] not in persons:
+                error='unknown person: %s' %(record['person'])
+            elif record['chore'] not in chores:
+                error='unknown chore: %s' %(record['chore'])
+            else:
+                try:
+                    the_date=day_number(datetime.strptime(record['date'], '%Y-%m-%d').date())
+                    error=None
+                except (TypeError, ValueError):
+                    error='not a valid date (yyyy-mm-dd): %s' %(record['date'])
+            if error:
+                number_of_errors+=1
+                if len(errors)<max_errors:
+                    errors.append((line, error))
+                continue
+            batch.append((the_date, persons[record['person']], chores[record['chore']]))
+            if len(batch)>=batch_size:
+                db.executemany('insert into actions (action_date, person_id, chore_id) values (?, ?, ?)', batch)
+                imported+=len(batch)
+                batch=[]
+        if batch:
+            db.executemany('insert into actions (action_date, person_id, chore_id) values (?, ?, ?)', batch)
+            imported+=len(batch)
+    except:
+        logging.critical('Error with importing actions.')
+        raise
+    logging.info('Imported %s actions, %s errors', imported, number_of_errors)
+    return imported, number_of_errors, errors
+
+def import_format(filename, the_format=None):
+    """Get the format of an import file: the given one, or from the extension
+    """
+    if the_format:
+        return the_format
+    return 'csv' if filename.lower().endswith('.csv') else 'ndjson'
+
+################################################################################
+# GENERATOR
+#
+GENERATOR_TASKS=('vacuum', 'mop', 'dust', 'tidy up', 'clean windows', 'clean', 'water plants', 'paint')
+GENERATOR_ROOMS=('kitchen', 'living room', 'bathroom', 'bedroom', 'hall', 'attic', 'garden', 'garage')
+GENERATOR_NAMES=('anna', 'bram', 'carla', 'daan', 'eva', 'finn', 'greet', 'hugo', 'iris', 'joost')
+#days between two actions on a chore, before scaling to the number of actions
+GENERATOR_CADENCES=(1, 1, 2, 3, 7, 7, 7, 14, 14, 30, 30, 91, 182, 365)
+
+def generator_size(scale):
+    """Get the number of actions, chores and persons for a scale factor
+
+    Scale 1 is 1M actions, 500 chores and 50 persons.
+    """
+    return dict(actions=int(1000000*scale), chores=max(5, int(500*scale)), persons=max(2, int(50*scale)))
+
+def generate_actions(db, actions=1000, chores=10, persons=3, days=3*365, end=None, seed=None, batch_size=10000, offline=False):
+    """Fill the database with new chores, persons and random actions
+
+    Every chore gets a cadence (days between two actions, scaled so the
+    total comes to about the number of actions) and a person who does it
+    most of the time; the others are picked with a skew, the first persons
+    doing more. The actions are spread over days, up to end (today), and
+    inserted in date order.
+
+    The actions are committed per batch_size. With offline (the command
+    line and the benchmarks, nobody else using the database) the triggers
+    and indexes on actions are dropped during the load and made again
+    afterwards, the summary tables are rebuilt, and synchronous is off. For
+    speed: otherwise the triggers keep the summaries up to date, as the
+    other requests go on reading them.
+    Returns the number of actions.
+    """
+    if chores<1 or persons<1:
+        raise ValueError('at least one chore and one person are needed')
+    rng=random.Random(seed)
+    end=day_number(end or date.today())
+    start=end-days+1
+    #chores and persons
+    first_chore=(db.execute('select max(id) from chores').fetchone()[0] or 0)+1
+    names=['%s %s' %(task, room) for room in GENERATOR_ROOMS for task in GENERATOR_TASKS]
+    chore_ids=list(range(first_chore, first_chore+chores))
+    db.executemany('insert into chores (id, name) values (?, ?)',
+        ((id, names[i] if i<len(names) else 'chore %s' %(id)) for i, id in enumerate(chore_ids)))
+    first_person=(db.execute('select max(id) from persons').fetchone()[0] or 0)+1
+    person_ids=list(range(first_person, first_person+persons))
+    db.executemany('insert into persons (id, name, password, role_id) values (?, ?, ?, 2)',
+        ((id, '%s %s' %(GENERATOR_NAMES[i%len(GENERATOR_NAMES)], id), 'resu') for i, id in enumerate(person_ids)))
+    db.commit()
+    #the cadences, scaled to the number of actions
+    cadences=[rng.choice(GENERATOR_CADENCES)*rng.uniform(0.8, 1.2) for id in chore_ids]
+    factor=sum(float(days)/cadence for cadence in cadences)/max(1, actions)
+    cadences=[cadence*factor for cadence in cadences]
+    owners=[rng.choice(person_ids) for id in chore_ids]
+    weights=[]
+    total=0.0
+    for i in range(persons):
+        total+=1.0/(i+1)
+        weights.append(total)
+    triggers=[]
+    if offline:
+        triggers=db.execute("select type, name, sql from sqlite_master where type in ('trigger', 'index') and tbl_name='actions' and sql is not null").fetchall()
+    synchronous=db.execute('pragma synchronous').fetchone()[0]
+    logging.warning('generating %s actions, dropping %s triggers and indexes', actions, len(triggers))
+    try:
+        if offline:
+            db.execute('pragma synchronous=OFF')
+        for row in triggers:
+            db.execute('drop %s %s' %(row['type'], row['name']))
+        db.commit()
+        #the next action of every chore, in a heap on the day
+        queue=[]
+        generated=0
+        while generated<actions:
+            batch=[]
+            while len(batch)<batch_size and generated+len(batch)<actions:
+                if not queue:
+                    #(again) from the start, with a random first action per chore
+                    queue=[(start+rng.uniform(0, min(cadence, days)), i) for i, cadence in enumerate(cadences)]
+                    heapq.heapify(queue)
+                when, i=heapq.heappop(queue)
+                if when>=end+1:
+                    #this chore is done
+                    continue
+                if rng.random()<0.6:
+                    person=owners[i]
+                else:
+                    person=person_ids[bisect.bisect(weights, rng.random()*total)]
+                batch.append((int(when), person, chore_ids[i]))
+                heapq.heappush(queue, (when+cadences[i]*rng.uniform(0.5, 1.5), i))
+            db.executemany('insert into actions (action_date, person_id, chore_id) values (?, ?, ?)', batch)
+            db.commit()
+            generated+=len(batch)
+    finally:
+        db.rollback()
+        if offline:
+            for row in triggers:
+                db.execute(row['sql'])
+            db.execute("update meta set message=message+1 where key='change_counter'")
+            db.commit()
+            db.execute('pragma synchronous=%s' %(synchronous))
+    if offline:
+        rebuild_summaries()
+    invalidate_settings()
+    logging.warning('generated %s actions', generated)
+    return generated
+
+################################################################################
+# STATIC ASSETS
+#
+FINGERPRINT=re.compile(r'^(.+)\.([0-9a-f]{12})(\.[^./]+)$')
+PRECOMPRESSED=(('br', '.br'), ('gzip', '.gz'))
+COMPRESS_STATIC=('.css', '.js', '.map', '.svg', '.eot', '.ttf')
+
+_fingerprints={}
+
+def fingerprint(filename):
+    """Get the first 12 characters of the md5 of a file in the static folder
+
+    The fingerprints are kept for the life of the process (except in debug,
+    where the files change).
+    """
+    if filename not in _fingerprints or app.debug:
+        with open(safe_join(app.static_folder, filename), 'rb') as f:
+            _fingerprints[filename]=hashlib.md5(f.read()).hexdigest()[:12]
+    return _fingerprints[filename]
+
+@app.template_global()
+def asset_url(filename):
+    """Get the url of a static file with its fingerprint in the name
+
+    jquery.min.js becomes /assets/jquery.min.<fingerprint>.js, so it can be
+    cached forever: a changed file gets a new url.
+    """
+    name, extension=os.path.splitext(filename)
+    return url_for('asset', filename='%s.%s%s' %(name, fingerprint(filename), extension))
+
+def compress_static(folder=None):
+    """Write a gzip (and brotli, if installed) version next to the static files
+
+    Run at install time (python housechores.py compress_static), the asset
+    route sends them to the clients that accept them.
+    Returns the number of files written.
+    """
+    folder=folder or app.static_folder
+    written=0
+    for root, dirs, files in os.walk(folder):
+        for filename in files:
+            if not filename.endswith(COMPRESS_STATIC):
+                continue
+            path=os.path.join(root, filename)
+            with open(path, 'rb') as f:
+                data=f.read()
+            with gzip.open(path + '.gz', 'wb', 9) as f:
+                f.write(data)
+            written+=1
+            if brotli is not None:
+                with open(path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data))
+                written+=1
+    return written
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Send a static file, with or without a fingerprint in the name
+
+    A fingerprinted file is cached by the browser for STATIC_MAX_AGE. The
+    precompressed version is sent if the browser accepts it and it is not
+    older than the file. The files without fingerprint are the ones linked
+    from the css (fonts), these get the default cache time.
+    """
+    match=FINGERPRINT.match(filename)
+    cache_timeout=None
+    if match:
+        filename=match.group(1) + match.group(3)
+        cache_timeout=app.config['STATIC_MAX_AGE']
+    path=safe_join(app.static_folder, filename)
+    if not os.path.isfile(path):
+        abort(404)
+    mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, extension in PRECOMPRESSED:
+        if encoding in request.accept_encodings and os.path.isfile(path + extension) \
+                and os.path.getmtime(path + extension)>=os.path.getmtime(path):
+            response=send_file(path + extension, mimetype=mimetype, cache_timeout=cache_timeout, conditional=True)
+            response.headers['Content-Encoding']=encoding
+            break
+    else:
+        response=send_file(path, mimetype=mimetype, cache_timeout=cache_timeout, conditional=True)
+    response.vary.add('Accept-Encoding')
+    if match:
+        response.headers['Cache-Control']='public, max-age=%s, immutable' %(cache_timeout)
+    return response
+
+################################################################################
+# COMPRESSION
+#
+def compress(data, encoding, level):
+    """Compress data with gzip or brotli (encoding 'br')
+    """
+    if encoding=='br':
+        return brotli.compress(data, quality=level)
+    buf=BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+class CompressionMiddleware(object):
+    """Compress the html and json answers for the browsers that accept it
+
+    Only complete answers (with a Content-Length) of at least
+    COMPRESS_MIN_SIZE bytes and with a mimetype in COMPRESS_MIMETYPES are
+    compressed. Streamed answers (no Content-Length) and answers that are
+    already compressed (the precompressed assets) are sent as they are.
+    Brotli is used if it is installed and accepted, otherwise gzip.
+    This runs around the whole application, so after the debug toolbar.
+    """
+    def __init__(self, wsgi_app, config):
+        self.wsgi_app=wsgi_app
+        self.config=config
+
+    def get_encoding(self, environ):
+        """Get the encoding to use, or None if the browser accepts none
+        """
+        accepted=parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and accepted.quality('br')>0:
+            return 'br'
+        if accepted.quality('gzip')>0:
+            return 'gzip'
+        return None
+
+    def wants_compression(self, status, headers):
+        """Check if an answer should be compressed, from its status and headers
+        """
+        length=headers.get('Content-Length', type=int)
+        mimetype=headers.get('Content-Type', '').split(';')[0].strip()
+        return (status.startswith('200') and
+            'Content-Encoding' not in headers and
+            length is not None and length>=self.config['COMPRESS_MIN_SIZE'] and
+            mimetype in self.config['COMPRESS_MIMETYPES'])
+
+    def __call__(self, environ, start_response):
+        encoding=self.get_encoding(environ)
+        if encoding is None or environ.get('REQUEST_METHOD')=='HEAD':
+            return self.wsgi_app(environ, start_response)
+        started=[]
+        def capture_start_response(status, headers, exc_info=None):
+            started[:]=[status, headers, exc_info]
+        app_iter=self.wsgi_app(environ, capture_start_response)
+        status, headers, exc_info=started
+        headers=Headers(headers)
+        if not self.wants_compression(status, headers):
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return app_iter
+        try:
+            data=b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        data=compress(data, encoding, self.config['COMPRESS_LEVEL'])
+        headers['Content-Encoding']=encoding
+        headers['Content-Length']=str(len(data))
+        headers.add('Vary', 'Accept-Encoding')
+        if headers.get('ETag', '').startswith('"'):
+            #the compressed answer is not byte for byte the same: make the ETag weak
+            headers['ETag']='W/' + headers['ETag']
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return [data]
+
+app.wsgi_app=CompressionMiddleware(app.wsgi_app, app.config)
 
 ################################################################################
 # APP ADMIN
@@ -132,10 +1556,16 @@ def check_admin(userid):
 @app.teardown_appcontext
 def close_db(error):
     """Closes the database again at the end of the request.
+
+    A persistent connection stays open, only an unfinished transaction
+    is rolled back.
     """
     if hasattr(g, 'db'):
-        logging.debug('closing the database')
-        g.db.close()
+        if app.config['PERSISTENT_CONNECTIONS']:
+            g.db.rollback()
+        else:
+            logging.debug('closing the database')
+            g.db.close()
 
 @app.before_request
 def before_request():
@@ -143,6 +1573,13 @@ def before_request():
     or wants to login
     or is requesting static data
     """
+    g.household=get_household()
+    if app.config.get('HOUSEHOLDS_DIR') and session.get('household')!=g.household:
+        #a login is for one household only
+        session.pop('uid', None)
+        session.pop('role', None)
+    if request.endpoint in ('static', 'asset', 'metrics'):
+        return
     try:
         path=request.path.split('/')[1]
         extension=request.path.split('/')[-1].split('.')[-1]
@@ -151,33 +1588,57 @@ def before_request():
         extension=None
     if 'uid' in session:
         g.current_user=session['uid']
-        db=get_db()
-        cursor=db.execute("select message from meta where key= 'appversion'")
-        g.appversion=cursor.fetchone()[0]
-        cursor=db.execute("select message from meta where key= 'dbversion'")
-        g.dbversion=cursor.fetchone()[0]
-        pass
+        settings=get_settings()
+        g.appversion=settings['appversion']
+        g.dbversion=settings['dbversion']
     elif (request.endpoint=='login' or request.endpoint=='loginscreen'):
         pass
-    elif (path=='static' and extension in ('js','css')):
-        pass
     elif (path=='_debug_toolbar' and extension in ('js', 'css')):
         pass
     else:
         flash("You don't fool me! Login first!","danger")
-        logging.warning('False attempt on %s: not logged in.' %(request.path))
+        logging.warning('False attempt on %s: not logged in.', request.path)
         return redirect(url_for('loginscreen'))
 
-@app.template_filter()
-def dayssince(value, the_format='%Y-%m-%d'):
-        today=datetime.today()
-        if value==None:
-            return None
+def wants_json():
+    """Check if the json version of a page is requested (?format=json)
+    """
+    return request.args.get('format')=='json'
+
+def etag_cached(view):
+    """Add an ETag to the json version of a page, and answer 304 if it matches
+
+    The ETag is made of the change_counter in the meta table (raised by
+    triggers on every change to the actions, chores and persons), the date
+    (for the days since), the database and the requested url. It is checked before the
+    page is generated, so a poll without changes costs no queries.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not wants_json():
+            return view(*args, **kwargs)
+        etag='%s-%s-%s' %(get_settings().get('change_counter'), date.today().strftime('%Y%m%d'),
+            hashlib.md5((current_database() + request.full_path).encode('utf-8')).hexdigest()[:16])
+        hit=request.if_none_match.contains_weak(etag)
+        count_cache('etag', hit)
+        if hit:
+            response=Response(status=304)
         else:
-            the_day= datetime.strptime(value,the_format)
-            return (today-the_day).days
+            response=make_response(view(*args, **kwargs))
+            if response.status_code!=200:
+                return response
+        response.set_etag(etag)
+        response.headers['Cache-Control']='private, no-cache'
+        return response
+    return wrapper
 
-app.jinja_env.filters['dayssince'] = dayssince
+def bump_change_counter(db):
+    """Raise the change_counter in the meta table
+
+    The triggers raise it for the changes to the actions, chores and
+    persons; this is for the other changes that show in the json pages.
+    """
+    db.execute("update meta set message=message+1 where key='change_counter'")
 
 ################################################################################
 # APP ROUTES
@@ -204,17 +1665,75 @@ def initdb():
         #if not possible: return to index
         return redirect (url_for('index'))
 
+@app.route('/migratedb')
+def migratedb():
+    """Migrate the database to the current version
+    """
+    logging.info('requesting to migrate the database')
+    if check_admin(g.current_user):
+        version=migrate_the_db()
+        flash('Migrated the database to version %s' %(version),'warning')
+    else:
+        flash('You have to be admin to migrate the database','error')
+    if request.referrer:
+        #refresh the referring page
+        return redirect(request.referrer)
+    else:
+        #if not possible: return to index
+        return redirect (url_for('index'))
+
+@app.route('/rebuild_summaries')
+def rebuild_summaries_route():
+    """Rebuild the summary tables
+    """
+    logging.info('requesting to rebuild the summary tables')
+    if check_admin(g.current_user):
+        rebuild_summaries()
+        flash('Rebuilt the summary tables','warning')
+    else:
+        flash('You have to be admin to rebuild the summary tables','error')
+    if request.referrer:
+        #refresh the referring page
+        return redirect(request.referrer)
+    else:
+        #if not possible: return to index
+        return redirect (url_for('index'))
+
 @app.route('/filldbsampledata')
 def fill_db_sample_data():
     """fill the database with sample data
+
+    with ?scale= (up to GENERATE_MAX_SCALE): generate random chores,
+    persons and actions instead, see generate_actions. ?seed= is optional.
     """
     db=get_db()
     if check_admin(g.current_user):
+        if request.args.get('scale'):
+            try:
+                scale=float(request.args['scale'])
+                if not 0<scale<=app.config['GENERATE_MAX_SCALE']:
+                    raise ValueError('scale out of range: %s' %(scale))
+            except ValueError as e:
+                logging.warning('Bad request for generated data: %s', e)
+                flash('Use a scale above 0 and up to %s' %(app.config['GENERATE_MAX_SCALE']),'warning')
+                return redirect(url_for('index'))
+            generated=generate_actions(db, seed=request.args.get('seed'), **generator_size(scale))
+            flash('Filled database with %s generated actions' %(generated),'warning')
+            return redirect(url_for('index'))
+        with app.open_resource('../sql/insert_sampledata.sql','r') as f:
+            script=f.read()
+        def insert_sample_data(db):
+            #statement by statement: executescript commits first, also the
+            #transaction of the writer thread
+            statement=''
+            for line in script.splitlines(True):
+                statement+=line
+                if sqlite3.complete_statement(statement):
+                    db.execute(statement)
+                    statement=''
         try:
-            with app.open_resource('../sql/insert_sampledata.sql','r') as f:
-                logging.warning('inserting sample data in database')
-                db.cursor().executescript(f.read())
-            db.commit()
+            logging.warning('inserting sample data in database')
+            write(insert_sample_data)
             flash('Filled database with sample data','warning')
         except:
             logging.critical('Error with filling the sample database.')
@@ -235,12 +1754,16 @@ def loginscreen():
     init the database and create a stand admin account. This should only happen
     on first use.
     """
+    if app.config.get('HOUSEHOLDS_DIR'):
+        #the database of a household is made on its first use
+        return render_template('login.html', ask_household=app.config['HOUSEHOLD_FROM']=='session')
     if not(os.path.isfile(app.config['DATABASE'])):
         # database doesn't exist yet --> create it
         open(app.config['DATABASE'], 'a').close()
         init_the_db()
         g.current_user=1
         session['uid']=1
+        session.pop('role', None)
         flash('Created default account: user=admin, pass=admin','warning')
         logging.warning('Created a default admin account')
         return redirect(url_for('index'))
@@ -254,12 +1777,23 @@ def login():
     if valid: redirect to index
     if not valid: return to loginscreen
     """
-    if request.form['user'] and request.form['password']:
+    if app.config.get('HOUSEHOLDS_DIR') and app.config['HOUSEHOLD_FROM']=='session':
+        household=request.form.get('household', '').strip().lower()
+        household=household if HOUSEHOLD_KEY.match(household) else None
+        if household!=g.household and hasattr(g, 'db'):
+            #the connection of the household of the session checks no other login
+            close_db(None)
+            g.pop('db')
+        g.household=household
+    if request.form['user'] and request.form['password'] and (g.get('household') or not app.config.get('HOUSEHOLDS_DIR')):
         pass_login=check_login(request.form['user'], request.form['password'])
         if pass_login:
-            logging.info('User %s passed login'%(request.form['user']))
+            logging.info('User %s passed login', request.form['user'])
             g.current_user=pass_login
             session['uid']=pass_login
+            session.pop('role', None)
+            if app.config.get('HOUSEHOLDS_DIR'):
+                session['household']=g.household
             return redirect(url_for('index'))
     logging.warning('User did NOT pass login')
     flash('Wrong username / password combination', 'danger')
@@ -269,8 +1803,10 @@ def login():
 def logout():
     """Log out
     """
-    logging.info('User %s trying to log out' %(g.current_user))
+    logging.info('User %s trying to log out', g.current_user)
     session.pop('uid')
+    session.pop('role', None)
+    session.pop('household', None)
     g.current_user=None
     flash('You were logged out','info')
     return redirect(url_for('loginscreen'))
@@ -280,19 +1816,7 @@ def export_xml():
     """Export the database as XML
     """
     if check_admin(g.current_user):
-        try:
-            db=get_db()
-            cur=db.execute('select * from xml_output')
-            rows=cur.fetchall()
-            writefile=app.config['XMLEXPORT']+'_' + str(g.current_user) + '.xml'
-            with open(writefile,'w') as f:
-                for row in rows:
-                    f.write(row[0] + '\n')
-            logging.debug('Fetching the database as xml output.')
-            flash(Markup('You can download the xml <a download href="' + url_for('download_xml') + '" target="_blank">file here</a>.'), 'info')
-        except:
-            logging.critical('Error with exporting as xml')
-            raise
+        flash(Markup('You can download the xml <a download href="' + url_for('download_xml') + '" target="_blank">file here</a>.'), 'info')
     else:
         flash('You have to be admin to export as xml','error')
     if request.referrer:
@@ -302,16 +1826,47 @@ def export_xml():
         #if not possible: return to index
         return redirect (url_for('index'))
 
+XML_TABLES=(
+    ('roles', 'role', ('id', 'name')),
+    ('chores', 'chore', ('id', 'name')),
+    ('persons', 'person', ('id', 'name', 'password', 'role_id')),
+    ('actions', 'action', ('id', 'action_date', 'person_id', 'chore_id')),
+)
+#the dates are exported as yyyy-mm-dd
+XML_EXPRESSIONS={'action_date': 'date(action_date)'}
+
+def generate_xml(db, chunk_size=500):
+    """Generate the database as xml
+
+    The tables are read with a cursor, chunk_size rows at a time, and every
+    chunk is yielded as one piece of text.
+    """
+    yield u'<?xml version="1.0" encoding="UTF-8"?>\n<housechores>\n'
+    for table, element, columns in XML_TABLES:
+        yield u'<%s>\n' %(table)
+        cursor=db.execute('select ' + ', '.join(XML_EXPRESSIONS.get(column, column) for column in columns) + ' from ' + table + ' order by id')
+        rows=cursor.fetchmany(chunk_size)
+        while rows:
+            yield u''.join(
+                u'    <%s>%s</%s>\n' %(element, u''.join(
+                    u'<%s>%s</%s>' %(column, escape(u'%s' %(value)) if value is not None else u'', column)
+                    for column, value in zip(columns, row)), element)
+                for row in rows)
+            rows=cursor.fetchmany(chunk_size)
+        yield u'</%s>\n' %(table)
+    yield u'</housechores>\n'
+
 @app.route('/download_xml')
 def download_xml():
-    """Download the generated xml
+    """Download the database as xml
+
+    The xml is streamed straight from the database, so the memory use is
+    the same for any size of database.
     """
     if check_admin(g.current_user):
-        writefile=app.config['XMLEXPORT']+'_' + str(g.current_user) + '.xml'
-        with open(writefile,'r') as f:
-            down=f.read()
-        response=make_response(down)
-        response.headers["Content-Disposition"] = '"attachment; filename=' + writefile + '"'
+        logging.debug('Streaming the database as xml output.')
+        response=Response(stream_with_context(generate_xml(get_db())), mimetype='application/xml')
+        response.headers['Content-Disposition']='attachment; filename=housechores.xml'
         return response
     else:
         if request.referrer:
@@ -322,98 +1877,335 @@ def download_xml():
             return redirect (url_for('index'))
 
 #PAGES
+def make_cursor(row):
+    """Make a paging token for the position of row in the overview
+
+    The overview is sorted on (action_date, id), so these two values mark
+    where a page starts or ends.
+    """
+    return '%s_%s' % (row['action_date'], row['id'])
+
+def parse_cursor(token):
+    """Get the (day number, id) back from a paging token, None when the
+    token is not valid
+    """
+    try:
+        action_date, id = token.rsplit('_', 1)
+        return day_number(action_date), int(id)
+    except ValueError:
+        logging.warning('Not a valid paging token: %s', token)
+        return None
+
 @app.route('/overview', methods=['GET'])
 @app.route('/overview/<page>', methods=['GET'])
+@etag_cached
 def overview(page=1):
     """Generate a simple overview of all the actions
 
     show the page with number = <page>
+    with ?format=json: return the actions as json
+
+    Paging is done with the ?after= and ?before= tokens (keyset paging), so
+    every page costs the same, no matter how deep. Without a (valid) token,
+    the page is looked up with an offset.
+    The actions can be filtered on ?chore= and ?person= (ids), and on
+    ?search= (words in the chore name, see fts_query).
     """
     page=int(page)
-    logging.debug('Generating the overview page, of page: ' + str(page))
+    logging.debug('Generating the overview page, of page: %s', page)
     db=get_db()
 
-    extraSql=''
+    where=[]
+    args=[]
+    filters={}
     personid=-1
-    choreid=-1
     if request.args.get('chore'):
-        extraSql=' where chore_id = ' + request.args.get('chore')
-        choreid=int(request.args.get('chore'))
+        filters['chore']=int(request.args.get('chore'))
+        where.append('chore_id = ?')
+        args.append(filters['chore'])
     if request.args.get('person'):
         personid=int(request.args.get('person'))
-        if len(extraSql)==0:
-            extraSql = ' where person_id = ' + request.args.get('person')
-        else:
-            extraSql += ' and person_id = ' + request.args.get('person')
+        where.append('person_id = ?')
+        args.append(personid)
+        filters['person']=personid
+    query=fts_query(request.args.get('search', ''))
+    if query:
+        where.append('chore_id in (select rowid from chores_fts where chores_fts match ?)')
+        args.append(query)
+        filters['search']=request.args.get('search')
 
-    max_actions_per_page=int(db.execute("select message from meta where key='actions_per_page'").fetchone()[0])
-    number_of_actions=int(db.execute("select count(*) from actions" + extraSql).fetchone()[0])
-    max_pages=number_of_actions//max_actions_per_page + 1
+    max_actions_per_page=int(get_settings()['actions_per_page'])
+    if where:
+        #the filters are on chore_id and person_id: count in the summary table
+        number_of_actions=int(db.execute('select coalesce(sum(aantal), 0) from chore_person_counts where ' + ' and '.join(where), args).fetchone()[0])
+    else:
+        number_of_actions=int(db.execute('select count(*) from actions').fetchone()[0])
+    max_pages=max(1, (number_of_actions + max_actions_per_page - 1)//max_actions_per_page)
     page=max_pages if page>max_pages else page
     page=1 if page<1 else page
 
-    cursor=db.execute('select * from overview ' + extraSql + ' order by action_date desc, chore asc limit ' + str(max_actions_per_page) + ' offset ' + str((page-1)*max_actions_per_page))
+    reverse=False
+    limit=max_actions_per_page
+    after=parse_cursor(request.args['after']) if request.args.get('after') else None
+    before=parse_cursor(request.args['before']) if request.args.get('before') else None
+    if after:
+        day, id=after
+        where.append('day <= ? and (day < ? or id < ?)')
+        args.extend([day, day, id])
+        sql=' order by day desc, id desc limit ?'
+    elif before:
+        day, id=before
+        where.append('day >= ? and (day > ? or id > ?)')
+        args.extend([day, day, id])
+        sql=' order by day asc, id asc limit ?'
+        reverse=True
+    elif request.args.get('last'):
+        #the oldest actions, as many as there are on the last page
+        page=max_pages
+        limit=max(1, number_of_actions-(max_pages-1)*max_actions_per_page)
+        sql=' order by day asc, id asc limit ?'
+        reverse=True
+    else:
+        sql=' order by day desc, id desc limit ? offset ' + str((page-1)*max_actions_per_page)
+    args.append(limit)
+    extraSql=' where ' + ' and '.join(where) if where else ''
+    cursor=db.execute('select * from overview' + extraSql + sql, args)
     rows=cursor.fetchall()
+    if reverse:
+        rows.reverse()
+    first=make_cursor(rows[0]) if rows else None
+    last=make_cursor(rows[-1]) if rows else None
+    if wants_json():
+        return jsonify(page=page, pages=max_pages, actions=[dict(row) for row in rows],
+            previous=url_for('overview', page=page-1, before=first, format='json', **filters) if page>1 and first else None,
+            next=url_for('overview', page=page+1, after=last, format='json', **filters) if page<max_pages and last else None)
     rows=[dict(id=-1,action_date=None, person_name=None,chore='No chores yet')] if len(rows)==0 else rows
     today=datetime.today().strftime('%Y-%m-%d')
-    return render_template('overview.html', rows=rows, chores=get_chores(), users=get_users(), today=today,cp=page, np=max_pages, choreid=choreid, personid=personid,is_admin=check_admin(g.current_user), appversion=g.appversion, dbversion=g.dbversion)
+    return render_template('overview.html', rows=rows, today=today,cp=page, np=max_pages, first=first, last=last, filters=filters, personid=personid,is_admin=check_admin(g.current_user), appversion=g.appversion, dbversion=g.dbversion)
 
 @app.route('/chores_lastaction')
+@etag_cached
 def chores_lastaction():
     """Generate a simple overview of all the chores with their last actioned
     date.
+
+    with ?format=json: return the chores as json
     """
     logging.debug('Generating the chores_lastaction page')
     db=get_db()
     cursor=db.execute('select * from chores_lastaction')
     rows=cursor.fetchall()
+    if wants_json():
+        return jsonify(chores=[dict(row) for row in rows])
     return render_template('chores_lastaction.html', rows=rows,is_admin=check_admin(g.current_user), appversion=g.appversion, dbversion=g.dbversion)
 
+@app.route('/changes')
+def changes():
+    """Wait for a change in the database (a long poll)
+
+    ?since= is the change_counter the client knows. The answer (json) is
+    the current change_counter, as soon as it differs, or after ?timeout=
+    seconds (at most CHANGES_TIMEOUT). Under WSGI the waiting holds a
+    thread; housechores_asgi asks with ?timeout=0 and waits without one.
+    """
+    since=request.args.get('since')
+    timeout=min(request.args.get('timeout', app.config['CHANGES_TIMEOUT'], type=float), app.config['CHANGES_TIMEOUT'])
+    deadline=time.time()+timeout
+    while True:
+        counter='%s' %(get_settings()['change_counter'])
+        if counter!=since or time.time()>=deadline:
+            break
+        time.sleep(app.config['CHANGES_POLL_SECONDS'])
+    return jsonify(change_counter=counter, changed=counter!=since)
+
+@app.route('/autocomplete/chores')
+def autocomplete_chores():
+    """Get the chores with the words of ?q= (as the start of their words)
+    as json, for the search box of the overview
+
+    At most ?limit= chores (at least 1), and not more than AUTOCOMPLETE_LIMIT.
+    """
+    limit=max(1, min(request.args.get('limit', app.config['AUTOCOMPLETE_LIMIT'], type=int), app.config['AUTOCOMPLETE_LIMIT']))
+    rows=search_chores(get_db(), request.args.get('q', ''), limit)
+    return jsonify(chores=[dict(row) for row in rows])
+
 @app.route('/user_admin')
 def user_admin():
     """Render the user and role admin page
     """
     if check_admin(g.current_user):
         logging.debug('Generating the user admin page')
-        if check_admin(g.current_user):
-            users=get_users_role();
-            roles=get_roles()
-            return render_template('user_admin.html', users=users, roles=roles,is_admin=check_admin(g.current_user), appversion=g.appversion, dbversion=g.dbversion)
+        users=get_users_role();
+        roles=get_roles()
+        return render_template('user_admin.html', users=users, roles=roles,is_admin=True, appversion=g.appversion, dbversion=g.dbversion)
     else:
         flash('You hava to be admin to do user administration','error')
     return redirect (url_for('index'))
 
+@app.route('/metrics')
+def metrics():
+    """Show the metrics of all the processes in the Prometheus text format
+
+    For admins, and for the scraper with the header
+    Authorization: Bearer <METRICS_TOKEN>. Not by the address of the client:
+    behind a (local) proxy every client comes from 127.0.0.1.
+    """
+    token=app.config.get('METRICS_TOKEN')
+    authorization=request.headers.get('Authorization', '')
+    scraper=bool(token) and hmac.compare_digest(authorization.encode('utf-8'), ('Bearer %s' %(token)).encode('utf-8'))
+    if not scraper and not ('uid' in session and check_admin(session['uid'])):
+        abort(403)
+    return Response(render_metrics(collect_metrics()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/slow_queries')
+def slow_queries_route():
+    """Render the slowest SQL statements since the start
+    """
+    if check_admin(g.current_user):
+        logging.debug('Generating the slow queries page')
+        queries=slow_queries()
+        if wants_json():
+            return jsonify(queries=queries)
+        return render_template('slow_queries.html', queries=queries, threshold=app.config.get('SLOW_QUERY_SECONDS'), is_admin=True, appversion=g.appversion, dbversion=g.dbversion)
+    else:
+        flash('You have to be admin to see the slow queries','error')
+    return redirect (url_for('index'))
+
+@app.route('/settings')
+def settings():
+    """Render the settings page
+    """
+    if check_admin(g.current_user):
+        logging.debug('Generating the settings page')
+        return render_template('settings.html', settings=get_settings(), is_admin=True, appversion=g.appversion, dbversion=g.dbversion)
+    else:
+        flash('You have to be admin to change the settings','error')
+    return redirect (url_for('index'))
+
+STATS_PERIODS={
+    'day': 'date(r.day)',
+    'week': "date(r.day, 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m', r.day)",
+    'year': "strftime('%Y', r.day)",
+}
+
+def get_trends(db, start, end, granularity):
+    """Count the actions per period from the action_rollup table
+
+    Returns the counts per period and chore, and per period and person,
+    for the days from start up to and including end. The period is the
+    day, the monday of the week, the month or the year.
+    """
+    period=STATS_PERIODS[granularity]
+    chores=db.execute('select ' + period + ' as period, r.chore_id, c.name as chore, sum(r.aantal) as aantal'
+        ' from action_rollup as r join chores as c on r.chore_id=c.id'
+        ' where r.day >= ? and r.day <= ?'
+        ' group by period, r.chore_id having sum(r.aantal)>0 order by period, chore', [start, end]).fetchall()
+    persons=db.execute('select ' + period + ' as period, r.person_id, p.name as person, sum(r.aantal) as aantal'
+        ' from action_rollup as r join persons as p on r.person_id=p.id'
+        ' where r.day >= ? and r.day <= ?'
+        ' group by period, r.person_id having sum(r.aantal)>0 order by period, person', [start, end]).fetchall()
+    return chores, persons
+
+def stats_trends():
+    """Generate the number of actions per period, as html or json
+    """
+    as_json=wants_json()
+    granularity=request.args.get('granularity') or 'month'
+    try:
+        if granularity not in STATS_PERIODS:
+            raise ValueError('unknown granularity: %s' %(granularity))
+        end=datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else date.today()
+        start=datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else end-timedelta(days=365)
+    except ValueError as e:
+        logging.warning('Bad request for the trends: %s', e)
+        if as_json:
+            return jsonify(error=str(e)), 400
+        flash('Use dates as yyyy-mm-dd and a granularity of day, week, month or year','warning')
+        return redirect(url_for('stats'))
+    chores, persons=get_trends(get_db(), day_number(start), day_number(end), granularity)
+    if as_json:
+        return jsonify(start=start.strftime('%Y-%m-%d'), end=end.strftime('%Y-%m-%d'), granularity=granularity,
+            chores=[dict(row) for row in chores], persons=[dict(row) for row in persons])
+    return render_template('stats.html', trends=True, chores=chores, persons=persons, start=start.strftime('%Y-%m-%d'), end=end.strftime('%Y-%m-%d'), granularity=granularity, is_admin=check_admin(g.current_user), appversion=g.appversion, dbversion=g.dbversion)
+
 @app.route('/stats')
+@etag_cached
 def stats():
+    """Generate the statistics page
+
+    With ?start=, ?end= (yyyy-mm-dd) or ?granularity= (day, week, month or
+    year), show the number of actions per period instead. These come from
+    the daily rollups, so they don't depend on the size of the history.
+    With ?format=json the numbers are returned as json.
+    """
+    if any(request.args.get(arg) for arg in ('start', 'end', 'granularity')):
+        return stats_trends()
     logging.debug('Generating the stats page')
     db=get_db()
     cursor=db.execute('select * from top_chores')
     rows=cursor.fetchall()
-    counter=range(len(rows)+1)
-    counter.pop(0)
-    rowsWithId=zip(counter,rows)
-    cursor=db.execute('select min(action_date) from actions')
-    daysSince=dayssince(cursor.fetchone()[0])
+    rowsWithId=list(enumerate(rows, 1))
+    cursor=db.execute('select ? - min(action_date) from actions', [day_number(date.today())])
+    daysSince=cursor.fetchone()[0]
     cursor=db.execute('select * from top_chores_per_user')
-    rows=cursor.fetchall()
-    counter=range(len(rows)+1)
-    counter.pop(0)
-    rowspers=zip(counter,rows)
+    rowsPerUser=cursor.fetchall()
+    if wants_json():
+        return jsonify(days=daysSince, top_chores=[dict(row) for row in rows], top_chores_per_user=[dict(row) for row in rowsPerUser])
+    rowspers=list(enumerate(rowsPerUser, 1))
     return render_template('stats.html', rows=rowsWithId, rowspers=rowspers,days=daysSince, is_admin=check_admin(g.current_user), appversion=g.appversion, dbversion=g.dbversion)
 
 
 #ACTIONS
+@app.route('/import_actions', methods=['POST'])
+def import_actions_route():
+    """Import actions from an uploaded csv or ndjson file
+
+    The POST data should contain the file, and optionally the format
+    """
+    if check_admin(g.current_user):
+        upload=request.files.get('file')
+        if not upload or not upload.filename:
+            flash('No file to import','warning')
+            return redirect(url_for('overview'))
+        the_format=import_format(upload.filename, request.form.get('format'))
+        #with WRITE_MODE='writer' the import has WRITE_TIMEOUT seconds,
+        #import large files with the command line
+        stream=upload.stream
+        imported, number_of_errors, errors=write(lambda db: import_actions(db, stream, the_format))
+        flash('Imported %s actions' %(imported), 'success')
+        if number_of_errors:
+            flash('%s lines were skipped' %(number_of_errors), 'warning')
+            for line, error in errors[:10]:
+                flash('Line %s: %s' %(line, error), 'warning')
+    else:
+        flash('You have to be admin to import actions','error')
+    return redirect(url_for('overview'))
+
 @app.route('/new_action', methods=['GET', 'POST'])
 def new_action():
-    """Get the URL request with the data for a newly performed action
+    """Get the URL request with the data for newly performed actions
+
+    The POST data can hold several actions: the n-th date, person and chore
+    belong together. Rows without a person or chore are skipped. All the
+    actions are saved in one transaction.
     """
     try:
-        db=get_db()
-        db.execute('insert into actions (action_date, person_id, chore_id) values (?, ?, ?)',
-            [request.form['date'], request.form['person'], request.form['chore']])
-        db.commit()
-        flash('New action added', 'success')
-        logging.info('New action added')
+        rows=[row for row in zip(request.form.getlist('date'), request.form.getlist('person'), request.form.getlist('chore')) if row[1] and row[2]]
+        if not rows:
+            flash('Choose a person and a chore for the new action', 'warning')
+            return redirect(url_for('overview'))
+        try:
+            rows=[(day_number(the_date), person, chore) for the_date, person, chore in rows]
+        except ValueError:
+            flash('Use dates as yyyy-mm-dd for the new action', 'warning')
+            return redirect(url_for('overview'))
+        write(lambda db: db.executemany('insert into actions (action_date, person_id, chore_id) values (?, ?, ?)', rows))
+        if len(rows)==1:
+            flash('New action added', 'success')
+        else:
+            flash('%s new actions added' %(len(rows)), 'success')
+        logging.info('%s new action(s) added', len(rows))
         return redirect(url_for('overview'))
     except:
         logging.critical('Error with inserting new action.')
@@ -423,11 +2215,9 @@ def new_action():
 def delete_action(id):
     """Delete the action with id = <id>
     """
-    db=get_db()
-    db.execute('delete from actions where id = ?',[id])
-    db.commit()
+    write(lambda db: db.execute('delete from actions where id = ?',[id]))
     flash('Action removed','success')
-    logging.info('Action %s removed' %(id))
+    logging.info('Action %s removed', id)
     return redirect(url_for('overview'))
 
 @app.route('/edit_action', methods=['POST'])
@@ -437,13 +2227,17 @@ def edit_action():
     The POST data should contain the action_id and the new chore description
     """
     try:
-        db=get_db()
+        try:
+            day=day_number(request.form['date'])
+        except ValueError:
+            flash('Use dates as yyyy-mm-dd for the action', 'warning')
+            return redirect(url_for('overview'))
         choreid=get_choreid(request.form['chore'])
         personid=get_userid(request.form['person'])
-        db.execute('update actions set chore_id=?, action_date=?, person_id=? where id=?',[choreid,request.form['date'],personid, request.form['id']])
-        db.commit()
+        id=request.form['id']
+        write(lambda db: db.execute('update actions set chore_id=?, action_date=?, person_id=? where id=?',[choreid,day,personid,id]))
         flash('Updated action','success')
-        logging.info('Updated action with id=%s' %(request.form['id']))
+        logging.info('Updated action with id=%s', id)
         return redirect(url_for('overview'))
     except:
         logging.critical('Error with updating action.')
@@ -454,15 +2248,14 @@ def copy_to_today(id):
     """copy the action with action_id=<id> to today
     """
     try:
-        db=get_db()
-        cursor=db.execute('select * from actions where id = ?', [id])
-        row=cursor.fetchone()
-        chore=row['chore_id']
-        today=str(date.today().strftime('%Y-%m-%d'))
-        db.execute('insert into actions (action_date,person_id,chore_id) values (?,?,?)' ,[today, g.current_user, chore])
-        db.commit()
+        today=day_number(date.today())
+        user=g.current_user
+        copied=write(lambda db: db.execute('insert into actions (action_date,person_id,chore_id) select ?, ?, chore_id from actions where id = ?', [today, user, id]).rowcount)
+        if not copied:
+            flash('There is no action with id %s to copy' %(id),'warning')
+            return redirect(url_for('overview'))
         flash('Action copied to today','success')
-        logging.info('Action with id %s copied to today' %id)
+        logging.info('Action with id %s copied to today', id)
         return redirect(url_for('overview'))
     except:
         logging.critical('Error with copying action to today.')
@@ -473,10 +2266,9 @@ def copy_to_today(id):
 def new_from_chore(id):
     """Inser new action for today of chore with id=<id>
     """
-    today=str(date.today().strftime('%Y-%m-%d'))
-    db=get_db()
-    db.execute('insert into actions (action_date, person_id, chore_id) values(?,?,?)', [today, g.current_user, id])
-    db.commit()
+    today=day_number(date.today())
+    user=g.current_user
+    write(lambda db: db.execute('insert into actions (action_date, person_id, chore_id) values(?,?,?)', [today, user, id]))
     flash('Chore added to today','success')
     logging.info('Action added')
     return redirect( url_for('chores_lastaction'))
@@ -486,13 +2278,13 @@ def delete_chore(id=0):
     """Delete chore with id=id
     """
     if check_admin(g.current_user):
-        db=get_db()
-        db.execute('delete from chores where id = ?',[id])
-        db.commit()
-        db.execute('delete from actions where chore_id = ?',[id])
-        db.commit()
+        def delete(db):
+            #the actions first: they refer to the chore
+            db.execute('delete from actions where chore_id = ?',[id])
+            db.execute('delete from chores where id = ?',[id])
+        write(delete)
         flash('Chore removed', 'info')
-        logging.info('Removed chore with id=%s' %id)
+        logging.info('Removed chore with id=%s', id)
     else:
         flash('You have to be admin to delete a chore','error')
     return redirect( url_for('chores_lastaction'))
@@ -503,11 +2295,10 @@ def new_chore():
     """
     try:
         if check_admin(g.current_user):
-            db=get_db()
-            db.execute('insert into chores (name) values (?)',[request.form['chore']])
-            db.commit()
+            chore=request.form['chore']
+            write(lambda db: db.execute('insert into chores (name) values (?)',[chore]))
             flash('New chore added', 'success')
-            logging.info('New chore added: %s' %(request.form['chore']))
+            logging.info('New chore added: %s', request.form['chore'])
         else:
             flash('You have to be admin to add a new chore','error')
         return redirect(url_for('chores_lastaction'))
@@ -523,11 +2314,10 @@ def edit_chore():
     """
     try:
         if check_admin(g.current_user):
-            db=get_db()
-            db.execute('update chores set name = ? where id = ?',[request.form['chore'], request.form['id']])
-            db.commit()
+            chore=[request.form['chore'], request.form['id']]
+            write(lambda db: db.execute('update chores set name = ? where id = ?',chore))
             flash('Chore updated', 'success')
-            logging.info('Edited chore with id=%s to %s' %(request.form['id'], request.form['chore']))
+            logging.info('Edited chore with id=%s to %s', request.form['id'], request.form['chore'])
         else:
             flash('You have to be admin to edit a chore','error')
         return redirect(url_for('chores_lastaction'))
@@ -535,6 +2325,34 @@ def edit_chore():
         logging.critical('Error with updating chore.')
         raise
 
+#SETTINGS
+@app.route('/edit_settings', methods=['POST'])
+def edit_settings():
+    """Edit the settings
+
+    The POST data should contain the new actions_per_page
+    """
+    try:
+        if check_admin(g.current_user):
+            actions_per_page=int(request.form['actions_per_page'])
+            if actions_per_page<1:
+                flash('There should be at least one action per page','warning')
+                return redirect(url_for('settings'))
+            def update(db):
+                db.execute("update meta set message=? where key='actions_per_page'",[str(actions_per_page)])
+                bump_change_counter(db)
+            write(update)
+            invalidate_settings()
+            flash('Settings updated', 'success')
+            logging.info('Changed actions_per_page to %s', actions_per_page)
+            return redirect(url_for('settings'))
+        else:
+            flash('You have to be admin to change the settings','error')
+            return redirect(url_for('index'))
+    except:
+        logging.critical('Error with updating the settings.')
+        raise
+
 #USERS
 @app.route('/new_user', methods=['POST'])
 def new_user():
@@ -549,11 +2367,11 @@ def new_user():
                 flash('Username already exists, try something else.','warning')
                 return redirect(url_for('user_admin'))
             else:
-                db.execute('insert into persons (name, password, role_id) values (?,?,?)',[request.form['name'], 'resu', request.form['roles']])
-                db.commit()
+                person=[request.form['name'], 'resu', request.form['roles']]
+                write(lambda db: db.execute('insert into persons (name, password, role_id) values (?,?,?)',person))
                 flash('New user added, password: resu', 'success')
                 flash('Please change the password','danger')
-                logging.info('New user added: %s' %(request.form['name']))
+                logging.info('New user added: %s', request.form['name'])
                 return redirect(url_for('user_admin'))
         else:
             flash('You have to be admin to add a new user','error')
@@ -567,11 +2385,17 @@ def delete_user(id):
     """Delete user with id=id
     """
     if check_admin(g.current_user):
-        db=get_db()
-        db.execute('delete from persons where id = ?',[id])
-        db.commit()
+        def delete(db):
+            db.execute('delete from persons where id = ?',[id])
+            bump_role_version(db)
+        try:
+            write(delete)
+        except sqlite3.IntegrityError:
+            flash('This user still has actions, remove those first.','warning')
+            logging.warning('User with id=%s not removed: there are actions for this user', id)
+            return redirect( url_for('user_admin'))
         flash('User removed', 'info')
-        logging.info('Removed user with id=%s' %id)
+        logging.info('Removed user with id=%s', id)
         return redirect( url_for('user_admin'))
     else:
         flash('You have to be admin to delete a user','error')
@@ -594,12 +2418,15 @@ def edit_user():
             else:
                 if request.form['passw'] and len(request.form['passw'])>3:
                     # checking if password is filled in
-                    db.execute('update persons set name = ?, password= ? , role_id= ? where id = ?',[request.form['person'], request.form['passw'], request.form['role'], request.form['id']])
+                    update=('update persons set name = ?, password= ? , role_id= ? where id = ?',[request.form['person'], request.form['passw'], request.form['role'], request.form['id']])
                 else:
-                    db.execute('update persons set name = ?, role_id= ? where id = ?',[request.form['person'], request.form['role'], request.form['id']])
-                db.commit()
+                    update=('update persons set name = ?, role_id= ? where id = ?',[request.form['person'], request.form['role'], request.form['id']])
+                def edit(db):
+                    db.execute(*update)
+                    bump_role_version(db)
+                write(edit)
                 flash('User updated', 'success')
-                logging.info('Edited user with id=%s' %(request.form['id']))
+                logging.info('Edited user with id=%s', request.form['id'])
                 return redirect(url_for('user_admin'))
         else:
             flash('You have to be admin to edit a user','error')
@@ -611,6 +2438,68 @@ def edit_user():
 ################################################################################
 # RUN
 #
+@contextmanager
+def household_context(household=None):
+    """An app context for the commands, for one household (with HOUSEHOLDS_DIR)
+    """
+    with app.app_context():
+        g.household=household
+        yield
+
+def main(argv):
+    """Run the application, or one of the maintenance commands
+    """
+    parser=argparse.ArgumentParser(description='Keep track of the house chores.')
+    parser.add_argument('--household', help='household for the commands (with HOUSEHOLDS_DIR)')
+    subparsers=parser.add_subparsers(dest='command')
+    subparsers.add_parser('run', help='run the application (default)')
+    subparsers.add_parser('migrate', help='migrate the database to the current version')
+    subparsers.add_parser('rebuild', help='rebuild the summary tables from the actions')
+    subparsers.add_parser('compress_static', help='write gzip (and brotli) versions of the static files')
+    generator=subparsers.add_parser('generate', help='fill the database with generated chores, persons and actions')
+    generator.add_argument('--scale', type=float, default=0.01, help='1 is 1M actions, 500 chores and 50 persons (default 0.01)')
+    generator.add_argument('--actions', type=int, help='number of actions (instead of the scale)')
+    generator.add_argument('--chores', type=int, help='number of chores (instead of the scale)')
+    generator.add_argument('--persons', type=int, help='number of persons (instead of the scale)')
+    generator.add_argument('--years', type=float, default=3, help='years of history, up to today')
+    generator.add_argument('--seed', type=int, help='seed for the random generator')
+    generator.add_argument('--database', help='database file (default: from the config); a new one is created')
+    importer=subparsers.add_parser('import', help='import actions from a csv or ndjson file')
+    importer.add_argument('file', help='file with date, person, chore (by name) per line')
+    importer.add_argument('--format', choices=('csv', 'ndjson'), help='format of the file (default: from the extension)')
+    args=parser.parse_args(argv or ['run'])
+
+    if args.command=='migrate':
+        with household_context(args.household):
+            print('Database at version %s' %(migrate_the_db()))
+    elif args.command=='rebuild':
+        with household_context(args.household):
+            rebuild_summaries()
+    elif args.command=='generate':
+        if args.database:
+            app.config['DATABASE']=args.database
+        size=generator_size(args.scale)
+        size.update((key, getattr(args, key)) for key in size if getattr(args, key) is not None)
+        with household_context(args.household):
+            if get_db().execute("select count(*) from sqlite_master where name='actions'").fetchone()[0]==0:
+                init_the_db()
+            start=time.time()
+            generated=generate_actions(get_db(), days=int(args.years*365), seed=args.seed, offline=True, **size)
+        print('Generated %s actions in %.1f seconds' %(generated, time.time()-start))
+    elif args.command=='compress_static':
+        print('Wrote %s compressed files' %(compress_static()))
+    elif args.command=='import':
+        with household_context(args.household):
+            with open(args.file, 'rb') as f:
+                db=get_db()
+                imported, number_of_errors, errors=import_actions(db, f, import_format(args.file, args.format))
+                db.commit()
+        for line, error in errors:
+            sys.stderr.write('line %s: %s\n' %(line, error))
+        print('Imported %s actions, skipped %s lines' %(imported, number_of_errors))
+    else:
+        logging.critical('FIRING UP THE FLASK APPLICATION')
+        app.run(host='0.0.0.0')
+
 if __name__=='__main__':
-    logging.critical('FIRING UP THE FLASK APPLICATION')
-    app.run(host='0.0.0.0')
+    main(sys.argv[1:])
@@ -7,8 +7,17 @@ Run via (auto discover will recognize this file_):
 >>>> py.test
 """
 import os
+import sys
+import json
+import sqlite3
+import subprocess
+import logging
 import pytest
 import tempfile
+from io import BytesIO
+from werkzeug.datastructures import MultiDict
+from datetime import date
+from xml.etree import ElementTree
 
 import housechores
 
@@ -24,6 +33,8 @@ def client(request):
         housechores.init_the_db()
     
     def teardown():
+        housechores.close_thread_db()
+        housechores.invalidate_settings()
         os.close(db_fd)
         os.unlink(housechores.app.config['DATABASE'])
     request.addfinalizer(teardown)
@@ -108,6 +119,108 @@ def test_add_action(client):
     assert b'New action added' in rv.data
     assert b'<td>groceries lidl</td>' in rv.data
 
+def test_add_several_actions(client):
+    """Test adding several actions in one post
+    """
+    login(client)
+    sample_db(client)
+    data=MultiDict([('date', '2015-09-01'), ('person', 3), ('chore', 4),
+        ('date', '2015-09-01'), ('person', 3), ('chore', 7),
+        ('date', '2015-09-02'), ('person', 2), ('chore', 8),
+        ('date', '2015-09-02'), ('person', ''), ('chore', '')])
+    rv=client.post('/new_action', data=data, follow_redirects=True)
+    assert b'3 new actions added' in rv.data
+    assert b'<td>groceries lidl</td>' in rv.data
+    assert b'<td>clean bathroom</td>' in rv.data
+    assert b'<td>clean cat litter</td>' in rv.data
+    assert count_actions() == 10
+
+def test_add_empty_action(client):
+    """Test adding an action without person and chore
+    """
+    login(client)
+    sample_db(client)
+    rv=client.post('/new_action', data=dict(date='2015-09-01', person='', chore=''), follow_redirects=True)
+    assert b'New action added' not in rv.data
+    assert count_actions() == 7
+
+def test_add_action_bad_date(client):
+    """Test adding an action with a date that can't be read
+    """
+    login(client)
+    sample_db(client)
+    rv=client.post('/new_action', data=dict(date='yesterday', person=1, chore=4), follow_redirects=True)
+    assert b'Use dates as yyyy-mm-dd' in rv.data
+    assert count_actions() == 7
+
+def test_action_dates_as_day_numbers(client):
+    """Test: the dates are kept as julian day numbers, the days since are
+    computed in the query
+    """
+    login(client)
+    sample_db(client)
+    client.post('/new_action', data=dict(date='20-10-2015', person=1, chore=4))
+    with housechores.app.app_context():
+        db=housechores.get_db()
+        row=db.execute('select action_date, date(action_date) from actions where chore_id=4').fetchone()
+    assert row[0] == date(2015, 10, 20).toordinal() + 1721425
+    assert row[1] == '2015-10-20'
+    data=json.loads(client.get('/chores_lastaction?format=json').data)
+    chore=[chore for chore in data['chores'] if chore['chore_id'] == 4][0]
+    assert chore['last_actioned'] == '2015-10-20'
+    assert chore['days'] == (date.today() - date(2015, 10, 20)).days
+
+def test_generate_actions(client):
+    """Test the generated chores, persons and actions
+    """
+    with housechores.app.app_context():
+        db=housechores.get_db()
+        schema="select type, name from sqlite_master where tbl_name='actions' order by name"
+        triggers=db.execute(schema).fetchall()
+        assert housechores.generate_actions(db, actions=2000, chores=20, persons=5, days=365, end=date(2015, 12, 31), seed=1, offline=True) == 2000
+        assert db.execute('select count(*) from chores').fetchone()[0] == 20
+        assert db.execute('select count(*) from persons').fetchone()[0] == 6
+        assert db.execute('select date(min(action_date)) from actions').fetchone()[0] >= '2015-01-01'
+        assert db.execute('select date(max(action_date)) from actions').fetchone()[0] <= '2015-12-31'
+        #the triggers are back and the summaries are up to date
+        assert db.execute(schema).fetchall() == triggers
+        assert db.execute('select sum(aantal) from chore_counts').fetchone()[0] == 2000
+        actions=db.execute('select action_date, person_id, chore_id from actions order by id').fetchall()
+    #the same seed gives the same actions
+    housechores.invalidate_settings()
+    with housechores.app.app_context():
+        housechores.init_the_db()
+        housechores.generate_actions(housechores.get_db(), actions=2000, chores=20, persons=5, days=365, end=date(2015, 12, 31), seed=1, offline=True)
+        assert housechores.get_db().execute('select action_date, person_id, chore_id from actions order by id').fetchall() == actions
+
+def test_generate_actions_route(client):
+    """Test generating actions from the sample data link, only for small sizes
+    """
+    login(client)
+    rv=client.get('/filldbsampledata?scale=0.001&seed=3', follow_redirects=True)
+    assert b'Filled database with 1000 generated actions' in rv.data
+    assert count_actions() == 1000
+    #the triggers stayed, they kept the summaries up to date
+    with housechores.app.app_context():
+        db=housechores.get_db()
+        assert db.execute('select sum(aantal) from chore_counts').fetchone()[0] == 1000
+        assert db.execute("select count(*) from sqlite_master where type='trigger' and tbl_name='actions'").fetchone()[0] > 0
+    rv=client.get('/filldbsampledata?scale=5', follow_redirects=True)
+    assert b'Use a scale above 0' in rv.data
+    assert count_actions() == 1000
+
+def test_copy_to_today(client):
+    """Test copying an action to today, and one that does not exist
+    """
+    login(client)
+    sample_db(client)
+    rv=client.get('/copy_to_today/1', follow_redirects=True)
+    assert b'Action copied to today' in rv.data
+    assert count_actions() == 8
+    rv=client.get('/copy_to_today/999', follow_redirects=True)
+    assert b'There is no action with id 999 to copy' in rv.data
+    assert count_actions() == 8
+
 def test_add_action_non_admin(client):
     """Test adding a new action as normal user
     """
@@ -160,6 +273,60 @@ def test_edit_action_non_admin(client):
     assert b'<td>groceries lidl</td>' in rv.data
     assert b'<td>random</td>' in rv.data
 
+def count_actions():
+    """Get the number of actions in the database
+    """
+    with housechores.app.app_context():
+        return housechores.get_db().execute('select count(*) from actions').fetchone()[0]
+
+def test_import_actions_csv(client):
+    """Test importing actions from a csv file, with some bad lines
+    """
+    login(client)
+    sample_db(client)
+    data=b'date,person,chore\n2015-09-01,anne,dishes\n2015-09-02,rob,vacuum\n2015-09-03,nobody,dishes\n15-09-2015,anne,dishes\n2015-09-04,anne,vacuum\n'
+    rv=client.post('/import_actions', data=dict(file=(BytesIO(data), 'actions.csv')), follow_redirects=True)
+    assert b'Imported 3 actions' in rv.data
+    assert b'2 lines were skipped' in rv.data
+    assert b'Line 4: unknown person: nobody' in rv.data
+    assert b'Line 5: not a valid date' in rv.data
+    assert count_actions() == 10
+
+def test_import_actions_ndjson(client):
+    """Test importing actions from a ndjson file
+    """
+    login(client)
+    sample_db(client)
+    data=b'{"date": "2015-09-01", "person": "anne", "chore": "dishes"}\n\n{"date": "2015-09-02", "person": "rob"}\nnot json\n'
+    rv=client.post('/import_actions', data=dict(file=(BytesIO(data), 'actions.ndjson')), follow_redirects=True)
+    assert b'Imported 1 actions' in rv.data
+    assert b'Line 3: date, person and chore are required' in rv.data
+    assert b'Line 4: not valid json' in rv.data
+    assert count_actions() == 8
+
+def test_import_actions_non_admin(client):
+    """Test importing actions as normal user
+    """
+    login(client)
+    sample_db(client)
+    #change user
+    client.get('logout', follow_redirects=True)
+    login(client, user='random', password='asd')
+    data=b'2015-09-01,anne,dishes\n'
+    rv=client.post('/import_actions', data=dict(file=(BytesIO(data), 'actions.csv')), follow_redirects=True)
+    assert b'Imported' not in rv.data
+    assert count_actions() == 7
+
+def test_import_actions_command(client, tmpdir):
+    """Test importing actions from the command line
+    """
+    login(client)
+    sample_db(client)
+    f=tmpdir.join('actions.csv')
+    f.write('2015-09-01,anne,dishes\n2015-09-02,rob,vacuum\n')
+    housechores.main(['import', str(f)])
+    assert count_actions() == 9
+
 ### Chores test
 def test_remove_chore(client):
     """Test to remove an existing chore
@@ -462,6 +629,46 @@ def test_edit_user_non_admin(client):
     rv=client.post('/edit_user', data=dict(person='newname', role=1, id=3, passw=''), follow_redirects=True)
     assert b'User updated' not in rv.data
 
+def test_admin_role_in_session(client):
+    """The role is kept in the session, until the users change
+    """
+    login(client)
+    sample_db(client)
+    client.get('/')
+    with client.session_transaction() as sess:
+        assert sess['role']['admin']
+        version=sess['role']['version']
+    client.post('/edit_user', data=dict(person='anne', role=1, id=3, passw=''))
+    client.get('/')
+    with client.session_transaction() as sess:
+        assert sess['role']['version'] != version
+
+def test_demoted_admin(client):
+    """A demoted admin loses the admin rights right away
+    """
+    login(client)
+    sample_db(client)
+    other=housechores.app.test_client()
+    login(other, user='rob', password='rob')
+    rv=other.get('/user_admin', follow_redirects=True)
+    assert b'User administration' in rv.data
+    #admin makes rob a normal user
+    rv=client.post('/edit_user', data=dict(person='rob', role=2, id=2, passw=''), follow_redirects=True)
+    assert b'User updated' in rv.data
+    rv=other.get('/user_admin', follow_redirects=True)
+    assert b'User administration' not in rv.data
+    assert b'You hava to be admin' in rv.data
+
+def test_remove_user_with_actions(client):
+    """A user with actions can't be removed: the actions refer to it
+    """
+    login(client)
+    sample_db(client)
+    rv=client.get('/delete_user/3', follow_redirects=True)
+    assert b'User removed' not in rv.data
+    assert b'still has actions' in rv.data
+    assert b'<td>anne</td><td>admin</td>' in rv.data.replace('\n','').replace('\t','')
+
 ### statistics
 def test_show_stats(client):
     """Test the statistics page
@@ -474,6 +681,107 @@ def test_show_stats(client):
     assert b'Who does what' in rv.data
     assert b'dishes' in rv.data #dishes should be done in sample db
 
+def test_stats_counts(client):
+    """The counts on the statistics page follow the changes to the actions
+    """
+    login(client)
+    sample_db(client)
+    rv=client.get('/stats')
+    assert b'<td>dishes</td><td>2</td>' in rv.data.replace(b'\n',b'').replace(b'\t',b'')
+    client.get('/delete_action/6')
+    rv=client.get('/stats')
+    assert b'<td>dishes</td><td>1</td>' in rv.data.replace(b'\n',b'').replace(b'\t',b'')
+    #move the last dishes to anne: rob has no dishes anymore
+    client.post('/edit_action', data=dict(id=1,chore='dishes',person='anne', date='2015-08-01'))
+    rv=client.get('/stats')
+    assert b'<td>dishes</td><td>anne</td><td>1</td>' in rv.data.replace(b'\n',b'').replace(b'\t',b'')
+    assert b'<td>dishes</td><td>admin</td>' not in rv.data.replace(b'\n',b'').replace(b'\t',b'')
+
+def test_stats_chores_with_the_same_name(client):
+    """Chores with the same name are counted on their own
+    """
+    login(client)
+    sample_db(client)
+    client.post('/edit_chore', data=dict(id=2,chore='dishes'))
+    rv=client.get('/stats')
+    assert rv.data.replace(b'\n',b'').replace(b'\t',b'').count(b'<td>dishes</td><td>2</td>') == 2
+
+def test_stats_trends_json(client):
+    """Test the number of actions per week as json
+    """
+    login(client)
+    sample_db(client)
+    rv=client.get('/stats?start=2015-08-01&end=2015-08-31&granularity=week&format=json')
+    data=json.loads(rv.data)
+    assert data['granularity'] == 'week'
+    #2015-08-01 is a saturday, its week starts on monday 2015-07-27
+    assert dict(period='2015-07-27', chore_id=1, chore='dishes', aantal=2) in data['chores']
+    assert dict(period='2015-08-10', chore_id=6, chore='clean toilet', aantal=1) in data['chores']
+    assert dict(period='2015-07-27', person_id=1, person='admin', aantal=6) in data['persons']
+    #changes to the actions show up in the rollups
+    client.get('/delete_action/6')
+    client.get('/delete_action/7')
+    rv=client.get('/stats?start=2015-08-01&end=2015-08-31&granularity=month&format=json')
+    data=json.loads(rv.data)
+    assert dict(period='2015-08', chore_id=1, chore='dishes', aantal=1) in data['chores']
+    assert [row['chore'] for row in data['chores']].count('clean toilet') == 0
+    assert data['persons'] == [dict(period='2015-08', person_id=1, person='admin', aantal=5)]
+
+def test_stats_trends_html(client):
+    """Test the number of actions per month as html
+    """
+    login(client)
+    sample_db(client)
+    rv=client.get('/stats?start=2015-01-01&end=2015-12-31&granularity=month')
+    assert b'Chores per month' in rv.data
+    assert b'<td>2015-08</td><td>dishes</td><td>2</td>' in rv.data.replace(b'\n',b'').replace(b'\t',b'')
+    rv=client.get('/stats?start=2015-08-03&end=2015-08-31&granularity=month')
+    assert b'<td>dishes</td>' not in rv.data
+
+def test_stats_trends_bad_request(client):
+    """Test the trends with a wrong granularity or date
+    """
+    login(client)
+    rv=client.get('/stats?granularity=decade&format=json')
+    assert rv.status_code == 400
+    rv=client.get('/stats?start=yesterday', follow_redirects=True)
+    assert b'Use dates as yyyy-mm-dd' in rv.data
+
+### json
+def test_json_pages(client):
+    """Test the json version of the overview, chores and statistics
+    """
+    login(client)
+    sample_db(client)
+    data=json.loads(client.get('/overview?format=json&chore=1').data)
+    assert data['page'] == 1
+    assert [action['id'] for action in data['actions']] == [6, 1]
+    data=json.loads(client.get('/chores_lastaction?format=json').data)
+    assert data['chores'][0]['chore'] == 'clean toilet'
+    assert data['chores'][0]['last_actioned'] == '2015-08-16'
+    data=json.loads(client.get('/stats?format=json').data)
+    assert dict(chore_id=1, name='dishes', aantal=2) in data['top_chores']
+
+def test_json_etag(client):
+    """Test: an unchanged json page is answered with 304 Not Modified
+    """
+    login(client)
+    sample_db(client)
+    for url in ('/overview?format=json', '/chores_lastaction?format=json', '/stats?format=json'):
+        rv=client.get(url)
+        assert rv.status_code == 200
+        etag=rv.headers['ETag']
+        rv=client.get(url, headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+        assert rv.data == b''
+    client.post('/new_action', data=dict(date='2015-09-01', person=1, chore=4))
+    for url in ('/overview?format=json', '/chores_lastaction?format=json', '/stats?format=json'):
+        rv=client.get(url, headers={'If-None-Match': etag})
+        assert rv.status_code == 200
+    #the html pages are not cached
+    rv=client.get('/overview')
+    assert 'ETag' not in rv.headers
+
 ### download database
 def test_download_database(client):
     """Test the xml download from the database
@@ -492,6 +800,20 @@ def test_download_database(client):
     assert b'admin' in rv.data
     assert b'2015-08-01' in rv.data
 
+def test_download_database_escaped(client):
+    """The xml download escapes the names and can be parsed
+    """
+    login(client)
+    sample_db(client)
+    client.post('/new_chore', data=dict(chore='pots & <pans>'))
+    rv=client.get('/download_xml')
+    assert rv.is_streamed
+    assert 'attachment' in rv.headers['Content-Disposition']
+    tree=ElementTree.fromstring(rv.data)
+    names=[chore.find('name').text for chore in tree.find('chores')]
+    assert 'pots & <pans>' in names
+    assert len(tree.find('actions')) == 7
+
 ### version numbers
 def test_version_numbers(client):
     login(client)
@@ -499,6 +821,117 @@ def test_version_numbers(client):
     assert b'Current version of application' in rv.data
     assert b'Current version of database' in rv.data
 
+### settings
+def test_settings_cache(client):
+    """The settings are read once, and again after a commit
+    """
+    login(client)
+    with housechores.app.app_context():
+        settings=housechores.get_settings()
+        assert settings['actions_per_page'] == '50'
+        assert housechores.get_settings() is settings
+        db=housechores.get_db()
+        db.execute("update meta set message='3' where key='actions_per_page'")
+        db.commit()
+        assert housechores.get_settings()['actions_per_page'] == '3'
+
+def test_settings_after_fork(client):
+    """A forked worker opens watch connections of its own, the ones of the
+    parent are left open
+    """
+    login(client)
+    with housechores.app.app_context():
+        housechores.get_settings()
+        database=housechores.current_database()
+        watch=housechores._settings[database]['watch']
+        #as if this process was forked
+        housechores._settings_pid['pid']=-1
+        assert housechores.get_settings()['actions_per_page'] == '50'
+        assert housechores._settings[database]['watch'] is not watch
+        assert housechores._settings_pid['pid'] == os.getpid()
+        watch.execute('select 1')
+
+def test_edit_settings(client):
+    """Test changing the number of actions per page
+    """
+    login(client)
+    sample_db(client)
+    rv=client.get('/settings')
+    assert b'Actions per page' in rv.data
+    rv=client.post('/edit_settings', data=dict(actions_per_page=3), follow_redirects=True)
+    assert b'Settings updated' in rv.data
+    rv=client.get('/overview')
+    assert b'Current page: 1 of 3' in rv.data
+
+def test_edit_settings_non_admin(client):
+    """Test changing the number of actions per page as normal user
+    """
+    login(client)
+    sample_db(client)
+    #change user
+    client.get('logout', follow_redirects=True)
+    login(client, user='random', password='asd')
+    rv=client.get('/settings', follow_redirects=True)
+    assert b'Actions per page' not in rv.data
+    rv=client.post('/edit_settings', data=dict(actions_per_page=3), follow_redirects=True)
+    assert b'Settings updated' not in rv.data
+    rv=client.get('/overview')
+    assert b'Current page' not in rv.data
+
+def test_migrate_db(client):
+    """Test migrating a database from version 0.4
+    """
+    login(client)
+    sample_db(client)
+    with housechores.app.app_context():
+        db=housechores.get_db()
+        #version 0.4 had no triggers, indexes or extra tables
+        tables=('roles', 'chores', 'persons', 'actions', 'meta', 'sqlite_sequence')
+        for row in db.execute("select type, name from sqlite_master where type in ('trigger', 'index', 'table')").fetchall():
+            if row[0]!='table' or row[1] not in tables:
+                db.execute('drop %s if exists %s' %(row[0], row[1]))
+        db.execute("update meta set message='0.4' where key in ('appversion', 'dbversion')")
+        #version 0.4 kept the dates as text
+        db.execute("update actions set action_date=date(action_date)")
+        db.execute("update actions set action_date='16-08-2015' where id=7")
+        db.commit()
+    rv=client.get('/')
+    assert b'Current version of database: 0.4' in rv.data
+    rv=client.get('/migratedb', follow_redirects=True)
+    assert b'Migrated the database to version 0.5' in rv.data
+    assert b'Current version of database: 0.5' in rv.data
+    rv=client.get('/chores_lastaction')
+    assert b'<td>2015-08-16</td>' in rv.data
+    with housechores.app.app_context():
+        db=housechores.get_db()
+        assert db.execute("select count(*) from actions where typeof(action_date)!='integer'").fetchone()[0] == 0
+    rv=client.get('/overview')
+    assert b'<td>2015-08-01</td>' in rv.data
+
+### lookups
+def test_lookup_cache(client):
+    """Test: the chores and persons lists are cached until one of them
+    changes, also when the change comes from another process
+    """
+    login(client)
+    sample_db(client)
+    rv=client.get('/overview')
+    assert b"<option value='4'>groceries lidl</option>" in rv.data
+    with housechores.app.app_context():
+        options=housechores.lookup_options('chores')
+        assert housechores.lookup_options('chores') is options
+    client.post('/edit_chore', data=dict(id=4, chore='groceries aldi'))
+    rv=client.get('/overview')
+    assert b"<option value='4'>groceries aldi</option>" in rv.data
+    assert b'groceries lidl' not in rv.data
+    #another process: a connection of its own
+    db=sqlite3.connect(housechores.app.config['DATABASE'])
+    db.execute("insert into persons (name, password, role_id) values ('<bob>', 'bob', 2)")
+    db.commit()
+    db.close()
+    rv=client.get('/overview')
+    assert b'>&lt;bob&gt;</option>' in rv.data
+
 ### paging
 def test_paging_overview(client):
     """Test: After loading the sample data, the overview page
@@ -519,5 +952,670 @@ def test_paging_overview(client):
     rv=client.get('/overview/2', follow_redirects=True)
     assert b'Current page' in rv.data
 
+def test_keyset_paging_overview(client):
+    """Test: the next, previous and last page are found with the paging
+    tokens (action_date, id) instead of an offset
+    """
+    login(client)
+    sample_db(client)
+    with housechores.app.app_context():
+        db=housechores.get_db()
+        db.execute("update meta set message='3' where key='actions_per_page'")
+        db.commit()
+    #sorted on date and id, the pages are: (7,6,4), (2,5,3), (1)
+    def page(url):
+        data=json.loads(client.get(url).data.decode('utf-8'))
+        return data['page'], [action['id'] for action in data['actions']], data['previous'], data['next']
+    rv=client.get('/overview')
+    assert b'<td>clean toilet</td>' in rv.data
+    assert b'after=2015-08-02_4' in rv.data
+    rv=client.get('/overview/2?after=2015-08-02_4')
+    assert b'Current page: 2 of 3' in rv.data
+    assert b'before=2015-08-02_2' in rv.data
+    assert b'after=2015-08-01_3' in rv.data
+    #forward with the next links
+    number, ids, previous, next=page('/overview?format=json')
+    assert (number, ids, previous) == (1, [7, 6, 4], None)
+    number, ids, previous, next=page(next)
+    assert (number, ids) == (2, [2, 5, 3])
+    number, ids, previous, next=page(next)
+    assert (number, ids, next) == (3, [1], None)
+    #back from the last page with the previous links
+    number, ids, previous, next=page('/overview/3?last=1&format=json')
+    assert (number, ids, next) == (3, [1], None)
+    rv=client.get('/overview/3?last=1')
+    assert b'Current page: 3 of 3' in rv.data
+    number, ids, previous, next=page(previous)
+    assert (number, ids) == (2, [2, 5, 3])
+    number, ids, previous, next=page(previous)
+    assert (number, ids, previous) == (1, [7, 6, 4], None)
+    #filters are kept while paging
+    rv=client.get('/overview?person=1')
+    assert b'person=1' in rv.data
+    #a token that is not valid falls back to the offset
+    for token in ('garbage', '2015-08-01_x', 'x_1'):
+        rv=client.get('/overview/2?after=' + token)
+        assert rv.status_code == 200
+        assert b'<td>change bedsheets</td>' in rv.data
+        rv=client.get('/overview/2?before=' + token)
+        assert b'<td>change bedsheets</td>' in rv.data
+
+### summary tables
+def last_actioned(choreid):
+    """Get the last actioned date of a chore from the summary table
+    """
+    with housechores.app.app_context():
+        db=housechores.get_db()
+        row=db.execute('select date(last_actioned) from chore_last_action where chore_id = ?', [choreid]).fetchone()
+    return row[0] if row else None
+
+def test_last_action_summary(client):
+    """The summary table follows the new, edited and deleted actions
+    """
+    login(client)
+    sample_db(client)
+    assert last_actioned(1) == '2015-08-02'
+    assert last_actioned(4) is None
+    client.post('/new_action', data=dict(date='2015-09-01', person=1, chore=4))
+    assert last_actioned(4) == '2015-09-01'
+    #deleting the last action should fall back to the previous one
+    client.get('/delete_action/6')
+    assert last_actioned(1) == '2015-08-01'
+    client.get('/delete_action/1')
+    assert last_actioned(1) is None
+    #moving an action to another chore updates both chores
+    client.post('/edit_action', data=dict(id=7,chore='dishes',person='anne', date='2015-08-20'))
+    assert last_actioned(1) == '2015-08-20'
+    assert last_actioned(6) is None
+    client.get('/new_from_chore/6')
+    assert last_actioned(6) == date.today().strftime('%Y-%m-%d')
+    client.get('/delete_chore/6')
+    assert last_actioned(6) is None
+
+def test_rebuild_summaries(client):
+    """Rebuilding repairs a summary table that has drifted
+    """
+    login(client)
+    sample_db(client)
+    with housechores.app.app_context():
+        db=housechores.get_db()
+        db.execute("update chore_last_action set last_actioned=0")
+        db.commit()
+    rv=client.get('/rebuild_summaries', follow_redirects=True)
+    assert b'Rebuilt the summary tables' in rv.data
+    assert last_actioned(1) == '2015-08-02'
+    assert last_actioned(6) == '2015-08-16'
+    rv=client.get('/chores_lastaction')
+    assert b'<td>2015-08-16</td>' in rv.data
+
+### connections
+def test_connection_pragmas(client):
+    """The connection is set up with the pragmas from the config
+    """
+    with housechores.app.app_context():
+        db=housechores.get_db()
+        assert db.execute('pragma journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('pragma foreign_keys').fetchone()[0] == 1
+        assert db.execute('pragma busy_timeout').fetchone()[0] == housechores.app.config['SQLITE_BUSY_TIMEOUT']
+
+def test_persistent_connection(client):
+    """The connection is kept open between requests in the same thread
+    """
+    with housechores.app.app_context():
+        db=housechores.get_db()
+    with housechores.app.app_context():
+        assert housechores.get_db() is db
+        db.execute('select * from meta').fetchall()
+
+### indexes
+def query_plan(sql, args=()):
+    """Return the EXPLAIN QUERY PLAN output of sql as one string
+    """
+    with housechores.app.app_context():
+        db=housechores.get_db()
+        rows=db.execute('explain query plan ' + sql, args).fetchall()
+    return ' '.join(row[3] for row in rows)
+
+def test_actions_indexes(client):
+    """The queries on actions should use the indexes, not scan the table
+    """
+    login(client)
+    sample_db(client)
+    assert 'actions_chore_date' in query_plan('select * from overview where chore_id = ?', [1])
+    assert 'actions_person_date' in query_plan('select * from overview where person_id = ?', [1])
+    assert 'actions_person_date' in query_plan('select count(*) from actions where person_id = ?', [1])
+    assert 'COVERING INDEX actions_chore_date' in query_plan('select max(action_date) from actions where chore_id = ?', [1])
+    assert 'actions' not in query_plan('select * from chores_lastaction')
+    assert 'actions' not in query_plan('select * from top_chores')
+    assert 'actions' not in query_plan('select * from top_chores_per_user')
+    assert 'COVERING INDEX actions_date' in query_plan('select min(action_date) from actions')
+    assert 'actions_chore_date' in query_plan('delete from actions where chore_id = ?', [1])
+
+def test_keyset_paging_index(client):
+    """A page after a paging token is a seek on the index, not a sort
+    """
+    login(client)
+    day=housechores.day_number('2015-08-02')
+    plan=query_plan('select * from overview where day <= ? and (day < ? or id < ?) order by day desc, id desc limit 3', [day, day, 4])
+    assert 'actions_date (action_date<?)' in plan
+    assert 'TEMP B-TREE' not in plan
+    plan=query_plan('select * from overview where chore_id = ? and day <= ? and (day < ? or id < ?) order by day desc, id desc limit 3', [1, day, day, 4])
+    assert 'actions_chore_date (chore_id=? AND action_date<?)' in plan
+    assert 'TEMP B-TREE' not in plan
+
+### static assets
+def test_static_without_login(client):
+    """Test: the static files, fonts included, don't need a login
+    """
+    rv=client.get('/static/bootstrap-3.3.5-dist/fonts/glyphicons-halflings-regular.woff2')
+    assert rv.status_code == 200
+    rv=client.get('/assets/bootstrap-3.3.5-dist/fonts/glyphicons-halflings-regular.woff')
+    assert rv.status_code == 200
+    rv=client.get('/assets/nothing.css')
+    assert rv.status_code == 404
+
+def test_fingerprinted_assets(client):
+    """Test: the pages link to the static files with a fingerprint, these are
+    cached forever
+    """
+    rv=client.get('/loginscreen')
+    url='/assets/override.%s.css' %(housechores.fingerprint('override.css'))
+    assert url.encode('utf-8') in rv.data
+    rv=client.get(url)
+    assert rv.status_code == 200
+    assert b'body' in rv.data
+    assert 'immutable' in rv.headers['Cache-Control']
+    assert 'max-age=%s' %(housechores.app.config['STATIC_MAX_AGE']) in rv.headers['Cache-Control']
+
+def test_precompressed_assets(client, tmpdir):
+    """Test: the gzip version of a static file is sent if the browser accepts it
+    """
+    tmpdir.join('style.css').write('body { color: black; }\n' * 100)
+    static_folder=housechores.app.static_folder
+    housechores.app.static_folder=str(tmpdir)
+    try:
+        assert housechores.compress_static() >= 1
+        assert tmpdir.join('style.css.gz').check()
+        rv=client.get('/assets/style.css', headers={'Accept-Encoding': 'gzip, deflate'})
+        assert rv.headers['Content-Encoding'] == 'gzip'
+        assert rv.headers['Content-Type'].startswith('text/css')
+        assert len(rv.data) < 2300
+        rv=client.get('/assets/style.css')
+        assert 'Content-Encoding' not in rv.headers
+        assert len(rv.data) == 2300
+    finally:
+        housechores.app.static_folder=static_folder
+
+### compression
+def test_compressed_overview(client):
+    """Test: the overview is sent with gzip to a browser that accepts it,
+    and gets a lot smaller
+    """
+    import gzip
+    login(client)
+    sample_db(client)
+    plain=client.get('/overview')
+    assert 'Content-Encoding' not in plain.headers
+    rv=client.get('/overview', headers={'Accept-Encoding': 'gzip'})
+    assert rv.headers['Content-Encoding'] in ('gzip', 'br')
+    assert 'Accept-Encoding' in rv.headers['Vary']
+    assert int(rv.headers['Content-Length']) == len(rv.data)
+    if rv.headers['Content-Encoding'] == 'gzip':
+        assert b'<td>change bedsheets</td>' in gzip.GzipFile(fileobj=BytesIO(rv.data)).read()
+    #the sample data gives a page of about 10kB, it should at least halve
+    assert len(rv.data) < len(plain.data) // 2
+
+def test_compression_skipped(client):
+    """Test: small, streamed and already compressed answers are not compressed
+    """
+    login(client)
+    housechores.app.config['COMPRESS_MIN_SIZE']=10**6
+    try:
+        rv=client.get('/overview', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in rv.headers
+    finally:
+        housechores.app.config['COMPRESS_MIN_SIZE']=500
+    rv=client.get('/download_xml', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in rv.headers
+    assert b'<housechores' in rv.data
+    rv=client.get('/assets/bootstrap-3.3.5-dist/fonts/glyphicons-halflings-regular.woff', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in rv.headers
+
+def test_compressed_json_etag(client):
+    """Test: the ETag of a compressed json page still gives a 304
+    """
+    login(client)
+    sample_db(client)
+    rv=client.get('/overview?format=json', headers={'Accept-Encoding': 'gzip'})
+    assert rv.headers['ETag'].startswith('W/')
+    rv=client.get('/overview?format=json', headers={'Accept-Encoding': 'gzip', 'If-None-Match': rv.headers['ETag']})
+    assert rv.status_code == 304
+
+### metrics
+def test_metrics(client):
+    """Test the metrics in the Prometheus text format
+    """
+    login(client)
+    sample_db(client)
+    client.get('/overview')
+    client.get('/overview')
+    rv=client.get('/metrics')
+    assert rv.status_code == 200
+    assert rv.headers['Content-Type'].startswith('text/plain')
+    text=rv.data.decode('utf-8')
+    assert '# TYPE housechores_request_duration_seconds histogram' in text
+    assert 'housechores_request_duration_seconds_bucket{endpoint="overview",method="GET",le="+Inf"}' in text
+    assert 'housechores_response_size_bytes_count{endpoint="overview"}' in text
+    assert 'housechores_sql_statements_total{endpoint="overview"}' in text
+    assert 'housechores_cache_total{cache="lookups",result="hit"}' in text
+    assert 'housechores_requests_total{endpoint="overview",method="GET",status="200"}' in text
+
+def test_metrics_of_failed_request(client):
+    """Test: a request that raises is counted as a 500
+    """
+    login(client)
+    sample_db(client)
+    with pytest.raises(sqlite3.IntegrityError):
+        client.post('/new_action', data=dict(date='2016-02-01', person='999', chore='1'))
+    text=client.get('/metrics').data.decode('utf-8')
+    assert 'housechores_requests_total{endpoint="new_action",method="POST",status="500"}' in text
+    assert 'housechores_request_duration_seconds_count{endpoint="new_action",method="POST"}' in text
+
+def test_metrics_only_for_admins(client):
+    """Test: the metrics are shown to admins and with METRICS_TOKEN only, not
+    by the address of the client
+    """
+    rv=client.get('/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'})
+    assert rv.status_code == 403
+    rv=client.get('/metrics', headers={'Authorization': 'Bearer None'})
+    assert rv.status_code == 403
+    housechores.app.config['METRICS_TOKEN']='scraper-token'
+    try:
+        rv=client.get('/metrics', headers={'Authorization': 'Bearer scraper-token'})
+        assert rv.status_code == 200
+        rv=client.get('/metrics', headers={'Authorization': 'Bearer other-token'})
+        assert rv.status_code == 403
+    finally:
+        housechores.app.config['METRICS_TOKEN']=None
+    login(client)
+    sample_db(client)
+    client.get('/logout')
+    login(client, user='random', password='asd')
+    rv=client.get('/metrics')
+    assert rv.status_code == 403
+    client.get('/logout')
+    login(client)
+    rv=client.get('/metrics')
+    assert rv.status_code == 200
+
+def test_metrics_of_several_processes(client, tmpdir):
+    """Test: with METRICS_DIR the metrics of the other processes are added
+    """
+    login(client)
+    housechores.app.config['METRICS_DIR']=str(tmpdir)
+    try:
+        client.get('/overview')
+        client.get('/metrics')
+        data=json.loads(tmpdir.listdir('%s-*.json' %(os.getpid()))[0].read())
+        #another process did the same
+        tmpdir.join('1.json').write(json.dumps(data))
+        metrics=housechores.collect_metrics()
+        labels='endpoint="overview",method="GET",status="200"'
+        assert metrics['counters']['housechores_requests_total'][labels] == 2*data['counters']['housechores_requests_total'][labels]
+    finally:
+        housechores.app.config['METRICS_DIR']=None
+
+def test_metrics_of_ended_processes(client, tmpdir):
+    """Test: the file of a process that ended is added to retired.json, a
+    new process with the pid of an old one keeps the old file
+    """
+    login(client)
+    housechores.app.config['METRICS_DIR']=str(tmpdir)
+    try:
+        client.get('/overview')
+        metrics=housechores.collect_metrics()
+        labels='endpoint="overview",method="GET",status="200"'
+        requests=metrics['counters']['housechores_requests_total'][labels]
+        #an old process with this pid, and one that ended
+        ended=subprocess.Popen(['true'])
+        ended.wait()
+        tmpdir.join('%s-1.json' %(os.getpid())).write(json.dumps(metrics))
+        tmpdir.join('%s-1.json' %(ended.pid)).write(json.dumps(metrics))
+        metrics=housechores.collect_metrics()
+        assert metrics['counters']['housechores_requests_total'][labels] == 3*requests
+        assert not tmpdir.join('%s-1.json' %(ended.pid)).check()
+        assert tmpdir.join('%s-1.json' %(os.getpid())).check()
+        assert tmpdir.join('retired.json').check()
+        metrics=housechores.collect_metrics()
+        assert metrics['counters']['housechores_requests_total'][labels] == 3*requests
+    finally:
+        housechores.app.config['METRICS_DIR']=None
+
+### logging
+def test_logging_through_queue(client):
+    """Test: the log records are written by the writer thread
+    """
+    handlers=[handler for handler in logging.getLogger().handlers if isinstance(handler, housechores.LogQueueHandler)]
+    assert len(handlers) == 1
+    logging.warning('queued message %s', 42)
+    #stopping the writer thread writes all the queued records
+    housechores.log_listener.stop()
+    housechores.log_listener.start()
+    with open(housechores.app.config['LOGFILE']) as f:
+        assert 'queued message 42' in f.read()
+
+def test_no_password_in_log(client, caplog):
+    """Test: the password is not logged at login
+    """
+    caplog.set_level(logging.DEBUG)
+    login(client, user='admin', password='secretpassword')
+    assert 'Checking the password of user: admin' in caplog.text
+    assert 'secretpassword' not in caplog.text
+
+### slow queries
+def test_slow_queries(client):
+    """Test: the slow statements are kept with their plan and endpoint
+    """
+    login(client)
+    sample_db(client)
+    threshold=housechores.app.config['SLOW_QUERY_SECONDS']
+    housechores.app.config['SLOW_QUERY_SECONDS']=0
+    try:
+        client.get('/overview?chore=1')
+    finally:
+        housechores.app.config['SLOW_QUERY_SECONDS']=threshold
+    queries=[query for query in housechores.slow_queries() if query['endpoint'] == 'overview' and 'from overview' in query['sql']]
+    assert queries
+    assert 'SCAN' in queries[0]['plan'] or 'SEARCH' in queries[0]['plan']
+    rv=client.get('/slow_queries?format=json')
+    assert rv.status_code == 200
+    assert len(json.loads(rv.data.decode('utf-8'))['queries']) <= housechores.app.config['SLOW_QUERY_TOP']
+    rv=client.get('/slow_queries')
+    assert b'Slow queries' in rv.data
+
+def test_slow_query_hides_password(client):
+    """Test: a slow login keeps the types of the parameters, never the
+    password, in the log, on /slow_queries and in METRICS_DIR
+    """
+    threshold=housechores.app.config['SLOW_QUERY_SECONDS']
+    housechores.app.config.update(SLOW_QUERY_SECONDS=0, METRICS_DIR=tempfile.mkdtemp())
+    try:
+        login(client, password='secret-pw')
+        login(client)
+        rv=client.get('/slow_queries?format=json')
+        housechores.log_listener.stop()
+        housechores.log_listener.start()
+        metrics=housechores.app.config['METRICS_DIR']
+        files=[open(os.path.join(metrics, filename)).read() for filename in os.listdir(metrics)]
+    finally:
+        housechores.app.config.update(SLOW_QUERY_SECONDS=threshold, METRICS_DIR=None)
+    queries=[query for query in json.loads(rv.data.decode('utf-8'))['queries'] if 'password=?' in query['sql']]
+    assert queries
+    assert queries[0]['params'] in ('(unicode, unicode)', '(str, str)')
+    assert b'secret-pw' not in rv.data
+    assert not any('secret-pw' in data for data in files)
+    with open(housechores.app.config['LOGFILE']) as f:
+        assert 'secret-pw' not in f.read()
+
+def test_slow_query_plan_keeps_transaction(client):
+    """Test: asking the plan of a slow statement does not commit its transaction
+    """
+    threshold=housechores.app.config['SLOW_QUERY_SECONDS']
+    housechores.app.config['SLOW_QUERY_SECONDS']=0
+    try:
+        with housechores.app.app_context():
+            db=housechores.get_db()
+            db.execute('insert into chores (name) values (?)', ['slow chore'])
+            db.execute('select * from chores where name=?', ['slow chore'])
+            db.rollback()
+            assert db.execute('select count(*) from chores where name=?', ['slow chore']).fetchone()[0] == 0
+    finally:
+        housechores.app.config['SLOW_QUERY_SECONDS']=threshold
+
+### long poll and asgi
+def test_changes(client):
+    """Test: /changes answers at once with another change_counter, and
+    after the timeout without a change
+    """
+    login(client)
+    rv=client.get('/changes?since=none')
+    data=json.loads(rv.data.decode('utf-8'))
+    assert data['changed']
+    rv=client.get('/changes?since=%s&timeout=0' %(data['change_counter']))
+    assert not json.loads(rv.data.decode('utf-8'))['changed']
+    sample_db(client)
+    rv=client.get('/changes?since=%s&timeout=0' %(data['change_counter']))
+    assert json.loads(rv.data.decode('utf-8'))['changed']
+
+@pytest.mark.skipif(sys.version_info[0] < 3, reason='the ASGI entry point needs python 3')
+def test_asgi(client):
+    """Test the routes and the long poll through the ASGI adapter
+    """
+    import asyncio
+    import asgi
+    application=asgi.WsgiToAsgi(housechores.app, workers=2)
+    loop=asyncio.new_event_loop()
+    try:
+        status, headers, body=loop.run_until_complete(asgi.asgi_request(application, 'POST', '/login',
+            headers={'Content-Type': 'application/x-www-form-urlencoded'}, body=b'user=admin&password=admin'))
+        assert status == 302
+        cookie={'Cookie': headers['set-cookie'].split(';')[0]}
+        status, headers, body=loop.run_until_complete(asgi.asgi_request(application, 'GET', '/overview', headers=cookie))
+        assert status == 200
+        assert b'No chores yet' in body
+        since=json.loads(loop.run_until_complete(asgi.asgi_request(application, 'GET', '/changes', 'since=none', cookie))[2].decode('utf-8'))['change_counter']
+        #a long poll that sees the sample data coming
+        poll=loop.create_task(asgi.asgi_request(application, 'GET', '/changes', 'since=%s&timeout=5' %(since), cookie))
+        loop.run_until_complete(asyncio.sleep(0.1))
+        assert not poll.done()
+        loop.run_until_complete(asgi.asgi_request(application, 'GET', '/filldbsampledata', headers=cookie))
+        status, headers, body=loop.run_until_complete(poll)
+        assert json.loads(body.decode('utf-8'))['changed']
+        status, headers, body=loop.run_until_complete(asgi.asgi_request(application, 'GET', '/overview', headers=cookie))
+        assert b'<td>dishes</td>' in body
+    finally:
+        application.executor.shutdown()
+        loop.close()
+
+### households
+@pytest.fixture
+def households(client, tmpdir):
+    """Run with a database per household in tmpdir
+    """
+    config=dict((key, housechores.app.config[key]) for key in ('HOUSEHOLDS_DIR', 'HOUSEHOLD_FROM', 'HOUSEHOLD_CREATE', 'SERVER_NAME'))
+    housechores.app.config.update(HOUSEHOLDS_DIR=str(tmpdir), HOUSEHOLD_FROM='subdomain', HOUSEHOLD_CREATE=True, SERVER_NAME=None)
+    yield tmpdir
+    housechores.close_thread_db()
+    housechores.invalidate_settings()
+    housechores.app.config.update(config)
+
+def test_households_by_subdomain(client, households):
+    """Test: every subdomain has its own database, made on first use
+    """
+    smiths=housechores.app.test_client()
+    smiths.post('/login', base_url='http://smiths.example.com', data=dict(user='admin', password='admin'))
+    smiths.get('/filldbsampledata', base_url='http://smiths.example.com')
+    rv=smiths.get('/overview', base_url='http://smiths.example.com')
+    assert b'<td>dishes</td>' in rv.data
+    jones=housechores.app.test_client()
+    jones.post('/login', base_url='http://jones.example.com', data=dict(user='admin', password='admin'))
+    rv=jones.get('/overview', base_url='http://jones.example.com')
+    assert b'No chores yet' in rv.data
+    assert households.join('smiths.db').check() and households.join('jones.db').check()
+    #a login of smiths (with a cookie for all the subdomains) is no login at jones
+    with jones.session_transaction(base_url='http://jones.example.com') as session:
+        session['household']='smiths'
+    rv=jones.get('/overview', base_url='http://jones.example.com')
+    assert rv.status_code == 302
+
+def test_households_by_session(client, households):
+    """Test: with HOUSEHOLD_FROM='session' the household is given at login,
+    and a login is for that household only
+    """
+    housechores.app.config['HOUSEHOLD_FROM']='session'
+    rv=client.get('/loginscreen')
+    assert b'name="household"' in rv.data
+    client.post('/login', data=dict(household='smiths', user='admin', password='admin'))
+    sample_db(client)
+    rv=client.get('/overview')
+    assert b'<td>dishes</td>' in rv.data
+    client.get('/logout')
+    client.post('/login', data=dict(household='jones', user='admin', password='admin'))
+    rv=client.get('/overview')
+    assert b'No chores yet' in rv.data
+
+def test_role_per_household(client, households):
+    """Test: the role kept in the session is not taken to another household,
+    where the same uid is another user
+    """
+    housechores.app.config['HOUSEHOLD_FROM']='session'
+    client.post('/login', data=dict(household='smiths', user='admin', password='admin'))
+    sample_db(client)
+    client.post('/login', data=dict(household='jones', user='admin', password='admin'))
+    client.post('/new_user', data=dict(name='rob', roles=2))
+    client.get('/logout')
+    #rob (uid 2) is admin at smiths and a normal user at jones
+    client.post('/login', data=dict(household='smiths', user='rob', password='rob'))
+    rv=client.get('/user_admin', follow_redirects=True)
+    assert b'User administration' in rv.data
+    client.post('/login', data=dict(household='jones', user='rob', password='resu'))
+    rv=client.get('/user_admin', follow_redirects=True)
+    assert b'User administration' not in rv.data
+
+def test_unknown_household(client, households):
+    """Test: without HOUSEHOLD_CREATE an unknown household is not found
+    """
+    housechores.app.config['HOUSEHOLD_CREATE']=False
+    rv=client.post('/login', base_url='http://nobody.example.com', data=dict(user='admin', password='admin'))
+    assert rv.status_code == 404
+    assert not households.join('nobody.db').check()
+
+def test_connection_pool(client, tmpdir):
+    """Test: a thread keeps at most MAX_CONNECTIONS connections open, the
+    one used longest ago is closed first
+    """
+    maximum=housechores.app.config['MAX_CONNECTIONS']
+    housechores.app.config['MAX_CONNECTIONS']=2
+    try:
+        with housechores.app.app_context():
+            first=housechores.get_thread_db(str(tmpdir.join('1.db')))
+            second=housechores.get_thread_db(str(tmpdir.join('2.db')))
+            assert housechores.get_thread_db(str(tmpdir.join('1.db'))) is first
+            housechores.get_thread_db(str(tmpdir.join('3.db')))
+            with pytest.raises(sqlite3.ProgrammingError):
+                second.execute('select 1')
+            first.execute('select 1')
+    finally:
+        housechores.app.config['MAX_CONNECTIONS']=maximum
+
+### writer thread
+@pytest.fixture
+def writer(client):
+    """Run with WRITE_MODE='writer'
+    """
+    config=dict((key, housechores.app.config[key]) for key in ('WRITE_MODE', 'WRITE_BATCH_SECONDS'))
+    housechores.app.config['WRITE_MODE']='writer'
+    yield client
+    housechores.stop_writer()
+    housechores.app.config.update(config)
+
+def test_writer_routes(writer):
+    """Test: the write routes work through the writer thread
+    """
+    login(writer)
+    sample_db(writer)
+    rv=writer.post('/new_action', data=MultiDict([('date', '2016-02-01'), ('person', '1'), ('chore', '1')]), follow_redirects=True)
+    assert b'New action added' in rv.data
+    rv=writer.get('/overview')
+    assert b'<td>2016-02-01</td>' in rv.data
+    rv=writer.post('/edit_action', data=dict(id=1, chore='groceries lidl', person='random', date='1980-01-01'), follow_redirects=True)
+    assert b'Updated action' in rv.data
+    assert b'<td>1980-01-01</td>' in rv.data
+    data=b'date,person,chore\n2015-09-01,anne,dishes\n2015-09-03,nobody,dishes\n'
+    rv=writer.post('/import_actions', data=dict(file=(BytesIO(data), 'actions.csv')), follow_redirects=True)
+    assert b'Imported 1 actions' in rv.data
+    assert b'1 lines were skipped' in rv.data
+    rv=writer.get('/copy_to_today/1', follow_redirects=True)
+    assert b'Action copied to today' in rv.data
+    rv=writer.get('/copy_to_today/999', follow_redirects=True)
+    assert b'There is no action with id 999 to copy' in rv.data
+    assert b'Action copied to today' not in rv.data
+    rv=writer.get('/delete_user/1', follow_redirects=True)
+    assert b'This user still has actions' in rv.data
+
+def test_writer_batches(writer):
+    """Test: the writes that come in together are committed together, and a
+    write that fails is rolled back on its own
+    """
+    import threading
+    housechores.app.config['WRITE_BATCH_SECONDS']=0.5
+    database=housechores.app.config['DATABASE']
+    def insert(name):
+        with housechores.app.app_context():
+            housechores.write(lambda db: db.execute('insert into chores (name) values (?)', [name]))
+    def fail(db):
+        db.execute("insert into chores (name) values ('failed')")
+        db.execute('insert into chores (id, name) values (1, 1)')
+    with housechores.app.app_context():
+        housechores.write(lambda db: db.execute("insert into chores (id, name) values (1, 'first')"))
+    threads=[threading.Thread(target=insert, args=('chore %s' %(i),)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    with housechores.app.app_context():
+        with pytest.raises(sqlite3.IntegrityError):
+            housechores.write(fail)
+    for thread in threads:
+        thread.join()
+    db=sqlite3.connect(database)
+    names=[row[0] for row in db.execute('select name from chores')]
+    db.close()
+    assert len([name for name in names if name.startswith('chore ')]) == 5
+    assert 'failed' not in names
+
+### search
+def test_autocomplete_chores(client):
+    """Test: the chores are found by the start of their words, and the
+    index follows the new, edited and deleted chores
+    """
+    login(client)
+    sample_db(client)
+    def names(q):
+        rv=client.get('/autocomplete/chores?q=%s' %(q))
+        return sorted(chore['name'] for chore in json.loads(rv.data.decode('utf-8'))['chores'])
+    assert names('groc') == ['groceries jumbo', 'groceries lidl']
+    assert names('cat lit') == ['change cat litter', 'clean cat litter']
+    assert names('"') == []
+    client.post('/new_chore', data=dict(chore='wash windows'))
+    assert names('wind') == ['wash windows']
+    client.post('/edit_chore', data=dict(id=5, chore='close curtains'))
+    assert names('bedsh') == []
+    assert names('curt') == ['close curtains']
+    client.get('/delete_chore/5')
+    assert names('curt') == []
+    rv=client.get('/autocomplete/chores?q=c&limit=1000')
+    assert len(json.loads(rv.data.decode('utf-8'))['chores']) <= housechores.app.config['AUTOCOMPLETE_LIMIT']
+    for limit in (0, -1):
+        rv=client.get('/autocomplete/chores?q=c&limit=%s' %(limit))
+        assert len(json.loads(rv.data.decode('utf-8'))['chores']) == 1
+
+def test_overview_search(client):
+    """Test: ?search= shows the actions of the chores with those words
+    """
+    login(client)
+    sample_db(client)
+    rv=client.get('/overview?search=groceries&format=json')
+    actions=json.loads(rv.data.decode('utf-8'))['actions']
+    assert actions
+    assert all(action['chore'].startswith('groceries') for action in actions)
+    rv=client.get('/overview?search=groc')
+    assert b'value="groc"' in rv.data
+    assert b'<td>dishes</td>' not in rv.data
+
+def test_search_index(client):
+    """Test: the search of the overview uses the full text index
+    """
+    plan=query_plan('select * from overview where chore_id in (select rowid from chores_fts where chores_fts match ?) order by day desc, id desc limit 50', ['"groc"*'])
+    assert 'VIRTUAL TABLE INDEX' in plan
+
 if __name__=='__main__':
     pytest.main(['-vv'])
@@ -0,0 +1,9 @@
+#python 3 only, run with an ASGI server, for example:
+#uvicorn --app-dir /var/www/housechores housechores_asgi:application
+import sys
+sys.path.insert(0,'/var/www/housechores')
+
+from app.housechores import app
+from app.asgi import WsgiToAsgi
+
+application=WsgiToAsgi(app)
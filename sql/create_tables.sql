@@ -11,6 +11,11 @@ drop view if exists xml_chores;
 drop view if exists xml_roles;
 drop view if exists top_chores;
 drop view if exists top_chores_per_user;
+drop table if exists chore_last_action;
+drop table if exists chore_counts;
+drop table if exists chore_person_counts;
+drop table if exists action_rollup;
+drop table if exists chores_fts;
 drop table if exists actions;
 drop table if exists persons;
 drop table if exists chores;
@@ -43,23 +48,29 @@ create table persons (
 --actions
 create table actions (
 	id integer primary key autoincrement,
-	action_date integer,
+	action_date integer, --julian day number: date(action_date) gives yyyy-mm-dd
 	person_id integer not null,
 	chore_id integer not null,
 	foreign key(person_id) references persons(id),
 	foreign key(chore_id) references chores(id)
 );
 
+--indexes on actions
+create index actions_chore_date on actions (chore_id, action_date);
+create index actions_person_date on actions (person_id, action_date);
+create index actions_date on actions (action_date);
+
 --overview
 create view overview as
 	select
 		a.id,
-		a.action_date,
+		a.action_date as day,
+		date(a.action_date) as action_date,
 		p.name as person_name,
-		p.id as person_id,
+		a.person_id,
 		r.name as role,
 		c.name as chore,
-		c.id as chore_id
+		a.chore_id
 	from
 		actions as a
 	left join
@@ -76,23 +87,55 @@ create view overview as
 		a.chore_id=c.id
 ;
 
+--last action per chore, kept up to date by the triggers on actions and chores
+create table chore_last_action (
+	chore_id integer primary key,
+	last_actioned integer
+);
+
+create trigger chores_delete_last_action after delete on chores
+begin
+	delete from chore_last_action where chore_id=old.id;
+end;
+
+create trigger actions_insert_last_action after insert on actions
+begin
+	insert or ignore into chore_last_action (chore_id, last_actioned) values (new.chore_id, new.action_date);
+	update chore_last_action set last_actioned=new.action_date
+	where chore_id=new.chore_id and (last_actioned is null or last_actioned<new.action_date);
+end;
+
+create trigger actions_delete_last_action after delete on actions
+begin
+	--only look for the previous action if the last one was deleted
+	update chore_last_action set last_actioned=(select max(action_date) from actions where chore_id=old.chore_id)
+	where chore_id=old.chore_id and last_actioned=old.action_date;
+end;
+
+create trigger actions_update_last_action after update of action_date, chore_id on actions
+begin
+	update chore_last_action set last_actioned=(select max(action_date) from actions where chore_id=old.chore_id)
+	where chore_id=old.chore_id and last_actioned=old.action_date;
+	insert or ignore into chore_last_action (chore_id, last_actioned) values (new.chore_id, new.action_date);
+	update chore_last_action set last_actioned=new.action_date
+	where chore_id=new.chore_id and (last_actioned is null or last_actioned<new.action_date);
+end;
+
 --chores last action
 create view chores_lastaction as
 	select
 		c.id as chore_id,
 		c.name as chore,
-		max(a.action_date) as last_actioned
+		date(l.last_actioned) as last_actioned,
+		cast(julianday('now', 'localtime') + 0.5 as integer) - l.last_actioned as days
 	from
 		chores as c
 	left join
-		actions as a
+		chore_last_action as l
 	on
-		c.id=a.chore_id
-	group by
-		c.id,
-		c.name
+		c.id=l.chore_id
 	order by
-		max(a.action_date) desc
+		l.last_actioned desc
 ;
 
 --users
@@ -110,124 +153,202 @@ create view users as
 		p.role_id=r.id
 ;
 
---xml
-create view xml_roles as
-	select '<roles>'
-	union all
-	select
-		'    <id>' || id || '</id>' ||
-		'    <name>' || name || '</name>'
-	from
-		roles
-	union all
-	select '</roles>'
-;
+--number of actions per chore, and per chore and person, kept up to date by the triggers on actions
+create table chore_counts (
+	chore_id integer primary key,
+	aantal integer not null default 0
+);
 
-create view xml_chores as
-	select '<chores>' 
-	union all
-	select
-		'    <id>' || id || '</id>' ||
-		'    <name>' || name || '</name>'
-	from
-		chores
-	union all
-	select '</chores>'
-;
+create table chore_person_counts (
+	chore_id integer not null,
+	person_id integer not null,
+	aantal integer not null default 0,
+	primary key (chore_id, person_id)
+);
 
-create view xml_persons as
-	select '<persons>'
-	union all
-	select
-		'    <id>' || id || '</id>' ||
-		'    <name>' || name || '</name>' ||
-		'    <password>' || password || '</password>' ||
-		'    <role_id' || role_id || '</role_id>'
-	from
-		persons
-	union all
-	select '</persons>'
-;
+create trigger chores_delete_counts after delete on chores
+begin
+	delete from chore_counts where chore_id=old.id;
+	delete from chore_person_counts where chore_id=old.id;
+end;
 
-create view xml_actions as
-	select '<actions>'
-	union all
-	select
-		'    <id>' || id || '</id>' ||
-		'    <action_date>' || action_date || '</action_date>' ||
-		'    <person_id>' || person_id || '</person_id>' ||
-		'    <chore_id>' || chore_id || '</chore_id>'
-	from
-		actions
-	union all
-	select '</actions>'
-;
+create trigger actions_insert_counts after insert on actions
+begin
+	insert or ignore into chore_counts (chore_id) values (new.chore_id);
+	update chore_counts set aantal=aantal+1 where chore_id=new.chore_id;
+	insert or ignore into chore_person_counts (chore_id, person_id) values (new.chore_id, new.person_id);
+	update chore_person_counts set aantal=aantal+1 where chore_id=new.chore_id and person_id=new.person_id;
+end;
 
-create view xml_output as
-	select * from xml_roles
-	union all
-	select ''
-	union all
-	select * from xml_chores
-	union all
-	select ''
-	union all
-	select * from xml_persons
-	union all
-	select ''
-	union all
-	select * from xml_actions
-;
+create trigger actions_delete_counts after delete on actions
+begin
+	update chore_counts set aantal=aantal-1 where chore_id=old.chore_id;
+	update chore_person_counts set aantal=aantal-1 where chore_id=old.chore_id and person_id=old.person_id;
+end;
+
+create trigger actions_update_counts after update of chore_id, person_id on actions
+begin
+	update chore_counts set aantal=aantal-1 where chore_id=old.chore_id;
+	update chore_person_counts set aantal=aantal-1 where chore_id=old.chore_id and person_id=old.person_id;
+	insert or ignore into chore_counts (chore_id) values (new.chore_id);
+	update chore_counts set aantal=aantal+1 where chore_id=new.chore_id;
+	insert or ignore into chore_person_counts (chore_id, person_id) values (new.chore_id, new.person_id);
+	update chore_person_counts set aantal=aantal+1 where chore_id=new.chore_id and person_id=new.person_id;
+end;
+
+--number of actions per day, chore and person, kept up to date by the triggers on actions
+create table action_rollup (
+	day integer not null,
+	chore_id integer not null,
+	person_id integer not null,
+	aantal integer not null default 0,
+	primary key (day, chore_id, person_id)
+);
+
+create trigger chores_delete_rollup after delete on chores
+begin
+	delete from action_rollup where chore_id=old.id;
+end;
+
+create trigger actions_insert_rollup after insert on actions
+begin
+	insert or ignore into action_rollup (day, chore_id, person_id) values (new.action_date, new.chore_id, new.person_id);
+	update action_rollup set aantal=aantal+1 where day=new.action_date and chore_id=new.chore_id and person_id=new.person_id;
+end;
+
+create trigger actions_delete_rollup after delete on actions
+begin
+	update action_rollup set aantal=aantal-1 where day=old.action_date and chore_id=old.chore_id and person_id=old.person_id;
+end;
+
+create trigger actions_update_rollup after update of action_date, chore_id, person_id on actions
+begin
+	update action_rollup set aantal=aantal-1 where day=old.action_date and chore_id=old.chore_id and person_id=old.person_id;
+	insert or ignore into action_rollup (day, chore_id, person_id) values (new.action_date, new.chore_id, new.person_id);
+	update action_rollup set aantal=aantal+1 where day=new.action_date and chore_id=new.chore_id and person_id=new.person_id;
+end;
 
 --top chores
 create view top_chores as
 	select
+		c.id as chore_id,
 		c.name,
-		count(*) as aantal
+		n.aantal
 	from
-		actions as a
-	left join
+		chore_counts as n
+	join
 		chores as c
 	on
-		a.chore_id=c.id
-	group by
-		c.name
+		n.chore_id=c.id
+	where
+		n.aantal>0
 	order by
-		count(*) DESC
+		n.aantal DESC
 ;
 
 create view top_chores_per_user as
 	select
+		c.id as chore_id,
 		c.name,
+		u.id as person_id,
 		u.name as person,
-		count(*) as aantal
+		n.aantal
 	from
-		actions as a
-	left join
+		chore_person_counts as n
+	join
 		chores as c
 	on
-		a.chore_id=c.id
+		n.chore_id=c.id
 	left join
 		persons as u
 	on
-		a.person_id=u.id
-	group by
-		c.name,
-		u.name
+		n.person_id=u.id
+	where
+		n.aantal>0
 	order by
-		count(*) desc
+		n.aantal desc
 ;
 
+--full text index on the chore names (the names themselves stay in chores),
+--kept up to date by the triggers on chores, see search_chores
+create virtual table chores_fts using fts5(name, content='chores', content_rowid='id', prefix='2 3');
+
+create trigger chores_insert_fts after insert on chores
+begin
+	insert into chores_fts (rowid, name) values (new.id, new.name);
+end;
+
+create trigger chores_delete_fts after delete on chores
+begin
+	insert into chores_fts (chores_fts, rowid, name) values ('delete', old.id, old.name);
+end;
+
+create trigger chores_update_fts after update on chores
+begin
+	insert into chores_fts (chores_fts, rowid, name) values ('delete', old.id, old.name);
+	insert into chores_fts (rowid, name) values (new.id, new.name);
+end;
+
 create table meta (
 	key text,
 	message text
 );
 
+--raised on every change to the actions, chores and persons, see etag_cached
+--the lookup_version only for the chores and persons, see get_lookup
+create trigger actions_insert_change after insert on actions
+begin
+	update meta set message=message+1 where key='change_counter';
+end;
+
+create trigger actions_delete_change after delete on actions
+begin
+	update meta set message=message+1 where key='change_counter';
+end;
+
+create trigger actions_update_change after update on actions
+begin
+	update meta set message=message+1 where key='change_counter';
+end;
+
+create trigger chores_insert_change after insert on chores
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+
+create trigger chores_delete_change after delete on chores
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+
+create trigger chores_update_change after update on chores
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+
+create trigger persons_insert_change after insert on persons
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+
+create trigger persons_delete_change after delete on persons
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+
+create trigger persons_update_change after update on persons
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+
 --insert standard data
 insert into roles values (1, 'admin');
 insert into roles values (2,'user');
 insert into persons (id, name, password, role_id) values (1,'admin', 'admin', 1);
 
-insert into meta values ('appversion','0.4');
-insert into meta values ('dbversion','0.4');
+insert into meta values ('appversion','0.5');
+insert into meta values ('dbversion','0.5');
 insert into meta values ('actions_per_page','50');
+insert into meta values ('role_version','0');
+insert into meta values ('change_counter','0');
+insert into meta values ('lookup_version','0');
@@ -12,10 +12,10 @@ insert into chores values (7,'clean bathroom');
 insert into chores values (8,'clean cat litter');
 insert into chores values (9,'change cat litter');
 
-insert into actions values (1,'2015-08-01',1,1);
-insert into actions values (2,'2015-08-02',1,2);
-insert into actions values (3,'2015-08-01',1,3);
-insert into actions values (4,'2015-08-02',1,2);
-insert into actions values (5,'2015-08-01',1,5);
-insert into actions values (6,'2015-08-02',1,1);
-insert into actions values (7,'2015-08-16',3,6);
+insert into actions values (1,cast(julianday('2015-08-01') + 0.5 as integer),1,1);
+insert into actions values (2,cast(julianday('2015-08-02') + 0.5 as integer),1,2);
+insert into actions values (3,cast(julianday('2015-08-01') + 0.5 as integer),1,3);
+insert into actions values (4,cast(julianday('2015-08-02') + 0.5 as integer),1,2);
+insert into actions values (5,cast(julianday('2015-08-01') + 0.5 as integer),1,5);
+insert into actions values (6,cast(julianday('2015-08-02') + 0.5 as integer),1,1);
+insert into actions values (7,cast(julianday('2015-08-16') + 0.5 as integer),3,6);
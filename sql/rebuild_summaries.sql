@@ -0,0 +1,15 @@
+--rebuild the summary tables from the actions
+delete from chore_last_action;
+insert into chore_last_action (chore_id, last_actioned)
+	select chore_id, max(action_date) from actions group by chore_id;
+delete from chore_counts;
+insert into chore_counts (chore_id, aantal)
+	select chore_id, count(*) from actions group by chore_id;
+delete from chore_person_counts;
+insert into chore_person_counts (chore_id, person_id, aantal)
+	select chore_id, person_id, count(*) from actions group by chore_id, person_id;
+delete from action_rollup;
+insert into action_rollup (day, chore_id, person_id, aantal)
+	select action_date, chore_id, person_id, count(*) from actions group by action_date, chore_id, person_id;
+--and the full text index of the chore names
+insert into chores_fts (chores_fts) values ('rebuild');
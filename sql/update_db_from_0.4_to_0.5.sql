@@ -0,0 +1,306 @@
+--indexes on actions
+create index if not exists actions_chore_date on actions (chore_id, action_date);
+create index if not exists actions_person_date on actions (person_id, action_date);
+create index if not exists actions_date on actions (action_date);
+
+--overview: filter on the actions columns, so the indexes can be used
+--the dates become julian day numbers, the application converts the existing
+--actions after this script (see convert_action_dates)
+drop view if exists overview;
+
+create view overview as
+	select
+		a.id,
+		a.action_date as day,
+		date(a.action_date) as action_date,
+		p.name as person_name,
+		a.person_id,
+		r.name as role,
+		c.name as chore,
+		a.chore_id
+	from
+		actions as a
+	left join
+		persons as p
+	on
+		a.person_id=p.id
+	left join
+		roles as r
+	on
+		p.role_id =r.id
+	left join
+		chores as c
+	on
+		a.chore_id=c.id
+;
+
+--last action per chore, kept up to date by the triggers on actions and chores
+create table chore_last_action (
+	chore_id integer primary key,
+	last_actioned integer
+);
+
+create trigger chores_delete_last_action after delete on chores
+begin
+	delete from chore_last_action where chore_id=old.id;
+end;
+
+create trigger actions_insert_last_action after insert on actions
+begin
+	insert or ignore into chore_last_action (chore_id, last_actioned) values (new.chore_id, new.action_date);
+	update chore_last_action set last_actioned=new.action_date
+	where chore_id=new.chore_id and (last_actioned is null or last_actioned<new.action_date);
+end;
+
+create trigger actions_delete_last_action after delete on actions
+begin
+	--only look for the previous action if the last one was deleted
+	update chore_last_action set last_actioned=(select max(action_date) from actions where chore_id=old.chore_id)
+	where chore_id=old.chore_id and last_actioned=old.action_date;
+end;
+
+create trigger actions_update_last_action after update of action_date, chore_id on actions
+begin
+	update chore_last_action set last_actioned=(select max(action_date) from actions where chore_id=old.chore_id)
+	where chore_id=old.chore_id and last_actioned=old.action_date;
+	insert or ignore into chore_last_action (chore_id, last_actioned) values (new.chore_id, new.action_date);
+	update chore_last_action set last_actioned=new.action_date
+	where chore_id=new.chore_id and (last_actioned is null or last_actioned<new.action_date);
+end;
+
+--chores last action
+drop view if exists chores_lastaction;
+
+create view chores_lastaction as
+	select
+		c.id as chore_id,
+		c.name as chore,
+		date(l.last_actioned) as last_actioned,
+		cast(julianday('now', 'localtime') + 0.5 as integer) - l.last_actioned as days
+	from
+		chores as c
+	left join
+		chore_last_action as l
+	on
+		c.id=l.chore_id
+	order by
+		l.last_actioned desc
+;
+
+--fill the summary table from the existing actions
+insert into chore_last_action (chore_id, last_actioned)
+	select chore_id, max(action_date) from actions group by chore_id;
+
+--number of actions per chore, and per chore and person, kept up to date by the triggers on actions
+create table chore_counts (
+	chore_id integer primary key,
+	aantal integer not null default 0
+);
+
+create table chore_person_counts (
+	chore_id integer not null,
+	person_id integer not null,
+	aantal integer not null default 0,
+	primary key (chore_id, person_id)
+);
+
+create trigger chores_delete_counts after delete on chores
+begin
+	delete from chore_counts where chore_id=old.id;
+	delete from chore_person_counts where chore_id=old.id;
+end;
+
+create trigger actions_insert_counts after insert on actions
+begin
+	insert or ignore into chore_counts (chore_id) values (new.chore_id);
+	update chore_counts set aantal=aantal+1 where chore_id=new.chore_id;
+	insert or ignore into chore_person_counts (chore_id, person_id) values (new.chore_id, new.person_id);
+	update chore_person_counts set aantal=aantal+1 where chore_id=new.chore_id and person_id=new.person_id;
+end;
+
+create trigger actions_delete_counts after delete on actions
+begin
+	update chore_counts set aantal=aantal-1 where chore_id=old.chore_id;
+	update chore_person_counts set aantal=aantal-1 where chore_id=old.chore_id and person_id=old.person_id;
+end;
+
+create trigger actions_update_counts after update of chore_id, person_id on actions
+begin
+	update chore_counts set aantal=aantal-1 where chore_id=old.chore_id;
+	update chore_person_counts set aantal=aantal-1 where chore_id=old.chore_id and person_id=old.person_id;
+	insert or ignore into chore_counts (chore_id) values (new.chore_id);
+	update chore_counts set aantal=aantal+1 where chore_id=new.chore_id;
+	insert or ignore into chore_person_counts (chore_id, person_id) values (new.chore_id, new.person_id);
+	update chore_person_counts set aantal=aantal+1 where chore_id=new.chore_id and person_id=new.person_id;
+end;
+
+--fill the counts from the existing actions
+insert into chore_counts (chore_id, aantal)
+	select chore_id, count(*) from actions group by chore_id;
+insert into chore_person_counts (chore_id, person_id, aantal)
+	select chore_id, person_id, count(*) from actions group by chore_id, person_id;
+
+--number of actions per day, chore and person, kept up to date by the triggers on actions
+create table action_rollup (
+	day integer not null,
+	chore_id integer not null,
+	person_id integer not null,
+	aantal integer not null default 0,
+	primary key (day, chore_id, person_id)
+);
+
+create trigger chores_delete_rollup after delete on chores
+begin
+	delete from action_rollup where chore_id=old.id;
+end;
+
+create trigger actions_insert_rollup after insert on actions
+begin
+	insert or ignore into action_rollup (day, chore_id, person_id) values (new.action_date, new.chore_id, new.person_id);
+	update action_rollup set aantal=aantal+1 where day=new.action_date and chore_id=new.chore_id and person_id=new.person_id;
+end;
+
+create trigger actions_delete_rollup after delete on actions
+begin
+	update action_rollup set aantal=aantal-1 where day=old.action_date and chore_id=old.chore_id and person_id=old.person_id;
+end;
+
+create trigger actions_update_rollup after update of action_date, chore_id, person_id on actions
+begin
+	update action_rollup set aantal=aantal-1 where day=old.action_date and chore_id=old.chore_id and person_id=old.person_id;
+	insert or ignore into action_rollup (day, chore_id, person_id) values (new.action_date, new.chore_id, new.person_id);
+	update action_rollup set aantal=aantal+1 where day=new.action_date and chore_id=new.chore_id and person_id=new.person_id;
+end;
+
+--fill the rollup from the existing actions
+insert into action_rollup (day, chore_id, person_id, aantal)
+	select action_date, chore_id, person_id, count(*) from actions group by action_date, chore_id, person_id;
+
+--top chores, from the counts
+drop view if exists top_chores;
+drop view if exists top_chores_per_user;
+
+--top chores
+create view top_chores as
+	select
+		c.id as chore_id,
+		c.name,
+		n.aantal
+	from
+		chore_counts as n
+	join
+		chores as c
+	on
+		n.chore_id=c.id
+	where
+		n.aantal>0
+	order by
+		n.aantal DESC
+;
+
+create view top_chores_per_user as
+	select
+		c.id as chore_id,
+		c.name,
+		u.id as person_id,
+		u.name as person,
+		n.aantal
+	from
+		chore_person_counts as n
+	join
+		chores as c
+	on
+		n.chore_id=c.id
+	left join
+		persons as u
+	on
+		n.person_id=u.id
+	where
+		n.aantal>0
+	order by
+		n.aantal desc
+;
+
+--the xml export is generated by the application
+drop view if exists xml_output;
+drop view if exists xml_actions;
+drop view if exists xml_persons;
+drop view if exists xml_chores;
+drop view if exists xml_roles;
+
+--raised on every change to the users, see check_admin
+insert into meta values ('role_version','0');
+
+--raised on every change to the actions, chores and persons, see etag_cached
+--the lookup_version only for the chores and persons, see get_lookup
+create trigger actions_insert_change after insert on actions
+begin
+	update meta set message=message+1 where key='change_counter';
+end;
+
+create trigger actions_delete_change after delete on actions
+begin
+	update meta set message=message+1 where key='change_counter';
+end;
+
+create trigger actions_update_change after update on actions
+begin
+	update meta set message=message+1 where key='change_counter';
+end;
+
+create trigger chores_insert_change after insert on chores
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+
+create trigger chores_delete_change after delete on chores
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+
+create trigger chores_update_change after update on chores
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+
+create trigger persons_insert_change after insert on persons
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+
+create trigger persons_delete_change after delete on persons
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+
+create trigger persons_update_change after update on persons
+begin
+	update meta set message=message+1 where key in ('change_counter', 'lookup_version');
+end;
+insert into meta values ('change_counter','0');
+insert into meta values ('lookup_version','0');
+
+--full text index on the chore names (the names themselves stay in chores),
+--kept up to date by the triggers on chores, see search_chores
+create virtual table if not exists chores_fts using fts5(name, content='chores', content_rowid='id', prefix='2 3');
+
+create trigger if not exists chores_insert_fts after insert on chores
+begin
+	insert into chores_fts (rowid, name) values (new.id, new.name);
+end;
+
+create trigger if not exists chores_delete_fts after delete on chores
+begin
+	insert into chores_fts (chores_fts, rowid, name) values ('delete', old.id, old.name);
+end;
+
+create trigger if not exists chores_update_fts after update on chores
+begin
+	insert into chores_fts (chores_fts, rowid, name) values ('delete', old.id, old.name);
+	insert into chores_fts (rowid, name) values (new.id, new.name);
+end;
+
+insert into chores_fts (chores_fts) values ('rebuild');
+
+update meta set message='0.5' where key='appversion';
+update meta set message='0.5' where key='dbversion';